@@ -0,0 +1,139 @@
+from __future__ import print_function
+import glob
+import io
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+
+class FileTimeout(BaseException):
+    """
+    Raised by the SIGALRM handler wherever parsing is. Not an Exception, so that the parsers'
+    handlers, which report a broken box and carry on, do not swallow it.
+    """
+
+
+def expand_inputs(patterns):
+    """Expand files, directories (recursively) and glob patterns into a list of inputs"""
+    for pattern in patterns:
+        if pattern.startswith('http://') or pattern.startswith('https://'):
+            yield pattern
+        elif os.path.isdir(pattern):
+            for dirpath, dirnames, filenames in os.walk(pattern):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    yield os.path.join(dirpath, filename)
+        elif glob.has_magic(pattern):
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path):
+                    yield path
+        else:
+            yield pattern
+
+
+def summarize(path):
+    from showboxes import open_input
+    from isobmff.box import Box
+    boxes = []
+    with open_input(path) as (source, name):
+        for depth, boxtype, offset, size, error in Box.scan(source):
+            box = {'type': boxtype, 'offset': offset, 'size': size, 'depth': depth}
+            if error:
+                box['error'] = error
+            boxes.append(box)
+    return boxes
+
+
+def build_tree(path, args, root):
+    from isobmff.box import iter_boxes
+    from showboxes import open_input, add_box, get_selection
+    from datasource import DataBuffer
+    with open_input(path) as (source, name):
+        # iter_boxes raises on broken input, unlike getboxlist which prints and carries on
+        for box in iter_boxes(DataBuffer(source), args.debug, selection=get_selection(args)):
+            add_box(root, box, args)
+
+
+def on_timeout(signum, frame):
+    raise FileTimeout()
+
+
+def inspect_file(task):
+    """Worker: parse one file and return (failed, JSON line); never raises"""
+    from showboxes import ErrorRecorder, set_diagnostics_stream
+    from tree import Tree
+    path, args = task
+    result = {'file': path}
+    # Parser diagnostics become part of the result, not of the JSON stream
+    logger = logging.getLogger('isobmff')
+    handlers, propagate = logger.handlers, logger.propagate
+    messages = io.StringIO()
+    set_diagnostics_stream(messages)
+    recorder = ErrorRecorder()
+    logger.addHandler(recorder)
+    start = time.time()
+    boxes = []
+    root = Tree(os.path.basename(path), "File")
+    try:
+        if args.timeout and hasattr(signal, 'SIGALRM'):
+            signal.alarm(args.timeout)
+        try:
+            if args.summary:
+                boxes = summarize(path)
+            else:
+                build_tree(path, args, root)
+        finally:
+            if args.timeout and hasattr(signal, 'SIGALRM'):
+                signal.alarm(0)
+    except FileTimeout:
+        result['error'] = "timed out after %d seconds" % args.timeout
+    except Exception as e:
+        result['error'] = "%s: %s" % (type(e).__name__, e)
+    finally:
+        logger.handlers, logger.propagate = handlers, propagate
+    # The parsers and the scan report a broken file and carry on; it has still failed
+    broken = [box for box in boxes if 'error' in box]
+    if 'error' not in result and broken:
+        result['error'] = "%s at %d: %s" % (broken[0]['type'], broken[0]['offset'], broken[0]['error'])
+    elif 'error' not in result and recorder.errors:
+        result['error'] = recorder.errors[0].strip().splitlines()[-1]
+    result['elapsed'] = round(time.time() - start, 6)
+    # Whatever was parsed before an error is still reported
+    result['boxes'] = boxes if args.summary else [child.to_dict() for child in root.children]
+    if messages.getvalue():
+        result['messages'] = messages.getvalue().splitlines()
+    return 'error' in result, json.dumps(result, default=str)
+
+
+def init_worker():
+    # Ctrl-C is handled by the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, on_timeout)
+
+
+def run_batch(patterns, args, out=None):
+    """
+    Inspect every file matched by patterns in a pool of args.workers processes and write one
+    JSON object per file to out as soon as it is done. Returns the number of files that failed.
+    """
+    out = out if out else sys.stdout
+    tasks = ((path, args) for path in expand_inputs(patterns))
+    failures = 0
+    pool = multiprocessing.Pool(args.workers, init_worker)
+    try:
+        for failed, line in pool.imap_unordered(inspect_file, tasks):
+            failures += failed
+            out.write(line + '\n')
+            out.flush()
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return failures
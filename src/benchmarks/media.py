@@ -0,0 +1,210 @@
+"""
+Deterministic synthetic ISO base media files for the benchmarks. The same case and scale
+always produce the same bytes: sample sizes come from a seeded generator and no timestamps
+or other environment dependent values are written.
+"""
+
+import random
+import struct
+import sys
+from array import array
+
+SEED = 0x6d703476
+
+# Full size of each case; scale multiplies the table lengths
+CASES = {
+    # Progressive file whose stsz and stco have this many entries
+    'progressive': 1000000,
+    # Fragmented file with this many moof boxes of 30 samples each
+    'fragmented': 50000,
+    # Encrypted fragmented file with this many moof boxes of 1000 samples, each with a senc
+    'cenc': 1000,
+    # HDS bootstrap (abst) whose afrt has this many entries
+    'hds': 1000000,
+}
+
+
+def box(boxtype, *payload):
+    data = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(data), boxtype.encode('latin-1')) + data
+
+
+def full_box(boxtype, version, flags, *payload):
+    return box(boxtype, struct.pack('>I', version << 24 | flags), *payload)
+
+
+def be32(values):
+    """values packed as big endian 32 bit integers, without going through struct per item"""
+    data = array('I', values)
+    if sys.byteorder == 'little':
+        data.byteswap()
+    return data.tobytes()
+
+
+def sample_sizes(rng, count, low, high):
+    return [rng.randint(low, high) for _ in range(count)]
+
+
+def sps_1280x720():
+    """Baseline profile SPS for 1280x720"""
+
+    def ue(value):
+        bits = bin(value + 1)[2:]
+        return '0' * (len(bits) - 1) + bits
+
+    bits = ('01100111' + '01000010' + '11000000' + '00011111' + ue(0) + ue(0) + ue(2) + ue(1) + '0' + ue(79)
+            + ue(44) + '1' + '1' + '0' + '0' + '1')
+    bits += '0' * (-len(bits) % 8)
+    return int(bits, 2).to_bytes(len(bits) // 8, 'big')
+
+
+def ftyp(brand, *compatible):
+    return box('ftyp', brand, struct.pack('>I', 0), *compatible)
+
+
+def mvhd(timescale, duration, next_track_id):
+    matrix = be32([0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000])
+    return full_box('mvhd', 0, 0, struct.pack('>IIIIIH', 0, 0, timescale, duration, 0x10000, 0x100), b'\0' * 10,
+                    matrix, b'\0' * 24, struct.pack('>I', next_track_id))
+
+
+def visual_sample_entry(boxtype, *children):
+    sps = sps_1280x720()
+    pps = b'\x68\xce\x3c\x80'
+    avcc = box('avcC', struct.pack('>BBBBBBH', 1, 66, 0xc0, 31, 0xff, 0xe1, len(sps)), sps,
+               struct.pack('>BH', 1, len(pps)), pps)
+    return box(boxtype, b'\0' * 6, struct.pack('>H', 1), b'\0' * 16,
+               struct.pack('>HHIIIH', 1280, 720, 0x480000, 0x480000, 0, 1), b'\0' * 32, struct.pack('>Hh', 0x18, -1),
+               avcc, *children)
+
+
+def video_trak(timescale, duration, sample_entry, stbl_tables):
+    matrix = be32([0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000])
+    tkhd = full_box('tkhd', 0, 3, struct.pack('>IIIII', 0, 0, 1, 0, duration), b'\0' * 8,
+                    struct.pack('>hhhH', 0, 0, 0, 0), matrix, struct.pack('>II', 1280 << 16, 720 << 16))
+    mdhd = full_box('mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, timescale, duration, 0x55c4, 0))
+    hdlr = full_box('hdlr', 0, 0, struct.pack('>I4s', 0, b'vide'), b'\0' * 12, b'VideoHandler\0')
+    vmhd = full_box('vmhd', 0, 1, struct.pack('>HHHH', 0, 0, 0, 0))
+    dinf = box('dinf', full_box('dref', 0, 0, struct.pack('>I', 1), full_box('url ', 0, 1)))
+    stsd = full_box('stsd', 0, 0, struct.pack('>I', 1), sample_entry)
+    stbl = box('stbl', stsd, *stbl_tables)
+    return box('trak', tkhd, box('mdia', mdhd, hdlr, box('minf', vmhd, dinf, stbl)))
+
+
+def empty_tables():
+    return [full_box(boxtype, 0, 0, struct.pack('>I', 0)) for boxtype in ('stts', 'stsc', 'stco')] + \
+        [full_box('stsz', 0, 0, struct.pack('>II', 0, 0))]
+
+
+def write_progressive(out, count):
+    """ftyp, a moov with count entry stsz and stco tables (one sample per chunk) and the mdat"""
+    rng = random.Random(SEED)
+    sizes = sample_sizes(rng, count, 8, 40)
+    head = ftyp(b'isom', b'isomiso2avc1mp41')
+
+    def moov(base):
+        offsets = array('I', [0]) * count
+        offset = base
+        for i, size in enumerate(sizes):
+            offsets[i] = offset
+            offset += size
+        tables = [
+            full_box('stts', 0, 0, struct.pack('>IIIII', 2, count - 1, 1000, 1, 500)),
+            full_box('stsc', 0, 0, struct.pack('>IIII', 1, 1, 1, 1)),
+            full_box('stsz', 0, 0, struct.pack('>II', 0, count), be32(sizes)),
+            full_box('stco', 0, 0, struct.pack('>I', count), be32(offsets)),
+            full_box('stss', 0, 0, struct.pack('>I', (count + 29) // 30), be32(range(1, count + 1, 30))),
+        ]
+        return box('moov', mvhd(30000, count * 1000, 2),
+                   video_trak(30000, count * 1000, visual_sample_entry('avc1'), tables))
+
+    # The offsets do not change the size of the moov, so a first pass gives where the mdat starts
+    out.write(head)
+    out.write(moov(len(head) + len(moov(0)) + 8))
+    out.write(struct.pack('>I4s', 8 + sum(sizes), b'mdat'))
+    out.write(bytes(sum(sizes)))
+
+
+def write_fragments(out, count, samples, encrypted):
+    rng = random.Random(SEED)
+    movie = [mvhd(30000, 0, 2)]
+    if encrypted:
+        kid = bytes(range(16))
+        tenc = full_box('tenc', 0, 0, b'\0\0', struct.pack('>BB', 1, 8), kid)
+        sinf = box('sinf', box('frma', b'avc1'), full_box('schm', 0, 0, b'cenc', struct.pack('>I', 0x10000)),
+                   box('schi', tenc))
+        entry = visual_sample_entry('encv', sinf)
+        # Widevine system id, with a small opaque payload
+        system_id = bytes.fromhex('edef8ba979d64acea3c827dcd51d21ed')
+        movie.append(full_box('pssh', 1, 0, system_id, struct.pack('>I', 1), kid, struct.pack('>I', 16), bytes(16)))
+    else:
+        entry = visual_sample_entry('avc1')
+    movie.append(video_trak(30000, 0, entry, empty_tables()))
+    movie.append(box('mvex', full_box('trex', 0, 0, be32([1, 1, 1000, 0, 0x01010000]))))
+    out.write(ftyp(b'iso6', b'iso6dash'))
+    out.write(box('moov', *movie))
+    for k in range(count):
+        sizes = sample_sizes(rng, samples, 16, 48)
+        tfhd = full_box('tfhd', 0, 0x020000 | 0x000020, struct.pack('>II', 1, 0x01010000))
+        tfdt = full_box('tfdt', 1, 0, struct.pack('>Q', k * samples * 1000))
+        trun_flags = 0x000001 | 0x000004 | 0x000200
+        if encrypted:
+            # Per sample: an 8 byte IV and two subsamples, each 5 clear bytes and the rest protected
+            entries = [struct.pack('>QHHIHI', k * samples + i, 2, 5, size // 2 - 5, 5, size - size // 2 - 5)
+                       for i, size in enumerate(sizes)]
+            senc = full_box('senc', 0, 2, struct.pack('>I', samples), *entries)
+            saiz = full_box('saiz', 0, 0, struct.pack('>BI', 22, samples))
+
+        def moof(data_offset, aux_offset):
+            trun = full_box('trun', 0, trun_flags, struct.pack('>IiI', samples, data_offset, 0x02000000), be32(sizes))
+            children = [tfhd, tfdt, trun]
+            if encrypted:
+                children += [saiz, full_box('saio', 0, 0, struct.pack('>II', 1, aux_offset)), senc]
+            return box('moof', full_box('mfhd', 0, 0, struct.pack('>I', k + 1)), box('traf', *children))
+
+        # Sizes do not depend on the offsets: lay out once, then fill them in. The senc comes
+        # last, so its sample data starts 16 bytes (header, version and count) into it
+        size = len(moof(0, 0))
+        aux_offset = size - len(senc) + 16 if encrypted else 0
+        out.write(moof(size + 8, aux_offset))
+        out.write(struct.pack('>I4s', 8 + sum(sizes), b'mdat'))
+        out.write(bytes(sum(sizes)))
+
+
+def write_fragmented(out, count):
+    write_fragments(out, count, 30, False)
+
+
+def write_cenc(out, count):
+    write_fragments(out, count, 1000, True)
+
+
+def write_hds(out, count):
+    """An HDS bootstrap: an abst with one segment run table and a count entry fragment run table"""
+    asrt = full_box('asrt', 0, 0, struct.pack('>BIII', 0, 1, 1, count))
+    entries = []
+    for i in range(count):
+        if i % 1000 == 999:
+            # Discontinuity entries have no duration and an indicator byte
+            entries.append(struct.pack('>IQIB', i + 1, i * 4000, 0, 2))
+        else:
+            entries.append(struct.pack('>IQI', i + 1, i * 4000, 4000))
+    afrt = full_box('afrt', 0, 0, struct.pack('>IBI', 1000, 0, count), *entries)
+    abst = full_box('abst', 0, 0, struct.pack('>IBIQQ', 1, 0, 1000, count * 4000, 0), b'\0', b'\0', b'\0', b'\0', b'\0',
+                    struct.pack('>B', 1), asrt, struct.pack('>B', 1), afrt)
+    out.write(abst)
+
+
+WRITERS = {
+    'progressive': write_progressive,
+    'fragmented': write_fragmented,
+    'cenc': write_cenc,
+    'hds': write_hds,
+}
+
+
+def write_case(name, path, scale=1.0):
+    """Write the named case, with its tables scaled by scale, to path"""
+    count = max(1, int(CASES[name] * scale))
+    with open(path, 'wb') as out:
+        WRITERS[name](out, count)
@@ -0,0 +1,306 @@
+#!/usr/bin/python
+"""
+Parser benchmarks on the synthetic files of benchmarks.media. Run from the src folder:
+
+    $ python -m benchmarks.run [-o results.json] [--scale 0.1] [--case progressive] [--compare old.json]
+
+Each case runs in a fresh process, so that its peak RSS is its own, and reports:
+the parse of the whole file through a buffered FileSource and through mmap (seconds, MB/s,
+boxes/s and the read() / seek() calls it made), the parse and generate_fields() time of every
+box class, re-parsed in isolation, and the time and output size of each renderer.
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from benchmarks.media import CASES, write_case
+from datasource import DataBuffer, FileSource, MmapSource
+
+MB = 1024.0 * 1024.0
+
+
+class CountingFileSource(FileSource):
+    """FileSource that counts the calls DataBuffer makes"""
+
+    def __init__(self, f):
+        super(CountingFileSource, self).__init__(f)
+        self.reads = 0
+        self.seeks = 0
+
+    def read(self, req_bytes):
+        self.reads += 1
+        return super(CountingFileSource, self).read(req_bytes)
+
+    def seek(self, count, pos):
+        self.seeks += 1
+        return super(CountingFileSource, self).seek(count, pos)
+
+
+class NullWriter(object):
+    """Sink for renderer output that only counts it"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, None where it is not available"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def walk(boxes):
+    stack = list(boxes)
+    while stack:
+        box = stack.pop()
+        yield box
+        stack.extend(box.children)
+
+
+def best_of(repeat, function):
+    """Smallest wall time of repeat calls of function, with the result of the last one"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def rates(seconds, size, boxes):
+    return {
+        'seconds': round(seconds, 6),
+        'mb_per_s': round(size / MB / seconds, 3) if seconds else None,
+        'boxes_per_s': round(boxes / seconds, 1) if seconds else None,
+    }
+
+
+def bench_parse(path, size, repeat):
+    from isobmff.box import load_box_registry
+    from showboxes import getboxlist
+    results = {}
+    state = {}
+    # The box modules are imported on first use; keep that out of the first timed run
+    load_box_registry()
+
+    def parse_file():
+        with open(path, 'rb') as f:
+            source = CountingFileSource(f)
+            buf = DataBuffer(source)
+            boxes = getboxlist(buf)
+            state.update(source=source, buf=buf)
+            return boxes
+
+    # One untimed run, so that the timed ones all start from warm caches
+    parse_file()
+    seconds, boxes = best_of(repeat, parse_file)
+    count = sum(1 for _ in walk(boxes))
+    results['file'] = rates(seconds, size, count)
+    results['file'].update(boxes=count, reads=state['source'].reads, seeks=state['source'].seeks,
+                           refills=state['buf'].refills, bytes_read=state['buf'].bytes_read)
+
+    # The mapping stays open: boxes may keep views into it
+    f = open(path, 'rb')
+
+    def parse_mmap():
+        buf = DataBuffer(MmapSource(f))
+        state.update(buf=buf)
+        return getboxlist(buf)
+
+    seconds, boxes = best_of(repeat, parse_mmap)
+    results['mmap'] = rates(seconds, size, count)
+    results['mmap'].update(boxes=count, refills=state['buf'].refills, bytes_read=state['buf'].bytes_read)
+    return results, boxes, f
+
+
+def bench_box_classes(boxes, f, repeat):
+    """Re-parse every box of each registered class in place, then time its generate_fields()"""
+    from isobmff.box import Box, expand_rows
+    by_class = {}
+    for box in walk(boxes):
+        # Generic containers and unknown boxes are plain Box; their cost is their children's
+        if type(box) is not Box:
+            by_class.setdefault(type(box), []).append(box)
+    buf = DataBuffer(MmapSource(f))
+    results = {}
+    for cls, instances in sorted(by_class.items(), key=lambda item: item[0].__name__):
+
+        def parse():
+            for box in instances:
+                buf.seekto(box.buffer_offset)
+                cls(buf, box.parent)
+
+        def fields():
+            for box in instances:
+                for _ in expand_rows(box.generate_fields()):
+                    pass
+
+        size = sum(box.size for box in instances)
+        parse_seconds, _ = best_of(repeat, parse)
+        fields_seconds, _ = best_of(repeat, fields)
+        results[cls.__name__] = {
+            'boxtype': instances[0].boxtype,
+            'count': len(instances),
+            'bytes': size,
+            'parse': rates(parse_seconds, size, len(instances)),
+            'generate_fields_seconds': round(fields_seconds, 6),
+        }
+    return results
+
+
+def bench_renderers(boxes, name, repeat):
+    from console import ConsoleRenderer
+    from showboxes import add_box
+    from structured import RENDERERS
+    from tree import Tree
+    results = {}
+    # Same settings as the command line: the console truncates, the structured formats do not
+    outputs = [('stdout', True)] + [(output, False) for output in sorted(RENDERERS)]
+    for output, truncate in outputs:
+        args = argparse.Namespace(truncate=truncate, depth=None, max_rows=10)
+
+        def build():
+            root = Tree(name, "File")
+            for box in boxes:
+                add_box(root, box, args)
+            return root
+
+        build_seconds, root = best_of(repeat, build)
+        sink = NullWriter()
+
+        def render():
+            sink.size = 0
+            if output == 'stdout':
+                renderer = ConsoleRenderer('  ')
+                renderer.disable_colors()
+                with contextlib.redirect_stdout(sink):
+                    renderer.render(root)
+            else:
+                RENDERERS[output](sink).render(root)
+
+        render_seconds, _ = best_of(repeat, render)
+        results[output] = {
+            'tree_seconds': round(build_seconds, 6),
+            'render_seconds': round(render_seconds, 6),
+            'output_bytes': sink.size,
+        }
+    return results
+
+
+def run_case(task):
+    """Worker: all measurements of one case, in a process of its own"""
+    case, path, repeat = task
+    size = os.path.getsize(path)
+    result = {'file_bytes': size}
+    # Parser diagnostics would otherwise be part of what is measured on a terminal
+    logging.getLogger('isobmff').addHandler(logging.NullHandler())
+    logging.getLogger('isobmff').propagate = False
+    result['parse'], boxes, f = bench_parse(path, size, repeat)
+    result['box_classes'] = bench_box_classes(boxes, f, repeat)
+    result['renderers'] = bench_renderers(boxes, os.path.basename(path), repeat)
+    result['peak_rss_bytes'] = peak_rss()
+    return case, result
+
+
+def compare(old, new):
+    """Print the parse throughput and render times of new against those of old"""
+    if old.get('scale') != new['scale']:
+        print("Warning: comparing scale %s with scale %s" % (old.get('scale'), new['scale']), file=sys.stderr)
+    print("%-12s %-22s %12s %12s %8s" % ('case', 'measure', 'old', 'new', 'change'))
+    for case, result in sorted(new['cases'].items()):
+        if case not in old.get('cases', {}):
+            continue
+        previous = old['cases'][case]
+        rows = [('parse %s MB/s' % mode, previous['parse'][mode]['mb_per_s'], result['parse'][mode]['mb_per_s'])
+                for mode in ('file', 'mmap')]
+        rows += [('render %s s' % output, previous['renderers'][output]['render_seconds'],
+                  result['renderers'][output]['render_seconds'])
+                 for output in sorted(result['renderers']) if output in previous['renderers']]
+        rows.append(('peak RSS MB', (previous['peak_rss_bytes'] or 0) / MB, (result['peak_rss_bytes'] or 0) / MB))
+        for measure, before, after in rows:
+            change = '%+.1f%%' % ((after - before) * 100.0 / before) if before else '-'
+            print("%-12s %-22s %12.3f %12.3f %8s" % (case, measure, before, after, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the parser and renderers on synthetic files')
+    parser.add_argument('-o', '--output', default='benchmark-results.json', help='JSON file for the results')
+    parser.add_argument('--case', action='append', choices=sorted(CASES), dest='cases',
+                        help='case to run; can be repeated, all of them by default')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the table sizes of every case, e.g. 0.01 for a quick run')
+    parser.add_argument('--repeat', type=int, default=1, help='run each measurement this many times, keep the best')
+    parser.add_argument('--media-dir', help='keep the generated files here and reuse them; a temporary '
+                        'directory by default')
+    parser.add_argument('--compare', metavar='RESULTS', help='print the changes from an earlier results file')
+    args = parser.parse_args()
+
+    cases = args.cases or sorted(CASES)
+    media_dir = args.media_dir or tempfile.mkdtemp(prefix='mp4viewer-bench-')
+    tasks = []
+    for case in cases:
+        path = os.path.join(media_dir, '%s-%g.mp4' % (case, args.scale))
+        if not os.path.exists(path):
+            print("Generating %s" % path, file=sys.stderr)
+            write_case(case, path, args.scale)
+        tasks.append((case, path, args.repeat))
+
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'cases': {},
+    }
+    # A fresh process per case keeps the peak RSS of one case out of the next
+    pool = multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1)
+    try:
+        for case, result in pool.imap(run_case, tasks):
+            results['cases'][case] = result
+            parse = result['parse']
+            print("%-12s %8.1f MB  file %8.2f MB/s %10.0f boxes/s  mmap %8.2f MB/s  peak RSS %.1f MB" %
+                  (case, result['file_bytes'] / MB, parse['file']['mb_per_s'], parse['file']['boxes_per_s'],
+                   parse['mmap']['mb_per_s'], (result['peak_rss_bytes'] or 0) / MB),
+                  file=sys.stderr)
+    finally:
+        pool.close()
+        pool.join()
+    if not args.media_dir:
+        for _, path, _ in tasks:
+            os.remove(path)
+        os.rmdir(media_dir)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import pickle
+import zlib
+
+
+class TreeCache(object):
+    """
+    On-disk cache of parsed box trees. Entries are keyed by the identity of the file (path,
+    size, mtime, inode) and the options that shape the tree, so any change to the file
+    simply misses. Entries are compressed pickles; the least recently used ones are
+    evicted once the cache grows beyond max_size bytes.
+    """
+    # Bump whenever the tree layout changes so old entries are ignored
+    VERSION = 1
+    MAX_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, directory=None, max_size=None):
+        if directory is None:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            directory = os.path.join(base, 'mp4viewer')
+        self.directory = directory
+        self.max_size = max_size if max_size else TreeCache.MAX_SIZE
+
+    def entry_path(self, path, options):
+        st = os.stat(path)
+        identity = (TreeCache.VERSION, os.path.realpath(path), st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev,
+                    options)
+        return os.path.join(self.directory, hashlib.sha1(repr(identity).encode('utf-8')).hexdigest())
+
+    def load(self, path, options=()):
+        """Return the cached tree for path parsed with options, or None"""
+        entry = self.entry_path(path, options)
+        try:
+            with open(entry, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        try:
+            tree = pickle.loads(zlib.decompress(data))
+        except Exception:
+            # Damaged, or pickled from classes that have changed since; unpickling such data can
+            # raise nearly anything, so it is a miss and the entry goes
+            self.remove(entry)
+            return None
+        # Mark the entry as recently used for eviction
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        return tree
+
+    def store(self, path, tree, options=()):
+        entry = self.entry_path(path, options)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0o700)
+        data = zlib.compress(pickle.dumps(tree, pickle.HIGHEST_PROTOCOL), 1)
+        if len(data) > self.max_size:
+            return
+        # Write to a temporary file and rename, so readers never see a partial entry
+        tmp = "%s.%d.tmp" % (entry, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, entry)
+        self.evict()
+
+    def remove(self, entry):
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            self.remove(os.path.join(self.directory, name))
+            total -= size
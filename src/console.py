@@ -11,34 +11,88 @@ class ConsoleRenderer(object):
     COLOR_HEADER = '\033[31m'
     COLOR_ATTR = '\033[36m'
     ENDCOL = '\033[0m'
+    # Lines are collected and written in blocks of about this many characters
+    BUFFER_SIZE = 64 * 1024
 
     def __init__(self, offset=None, indent_unit='    '):
         self.offset = '' if offset is None else offset
         self.indent_unit = indent_unit
         self.header_prefix = '`' + indent_unit.replace(' ', ConsoleRenderer.HORI)[1:]
+        self.lines = []
+        self.pending = 0
 
-    def show_node(self, node, prefix):
-        write("%s%s%s%s%s\n" %
-              (prefix, self.header_prefix, ConsoleRenderer.COLOR_HEADER, node.name, ConsoleRenderer.ENDCOL))
-        if len(node.children):
+    def emit(self, line):
+        self.lines.append(line)
+        self.pending += len(line)
+        if self.pending >= ConsoleRenderer.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        write(''.join(self.lines))
+        sys.stdout.flush()
+        self.lines = []
+        self.pending = 0
+
+    def show_header(self, node, prefix, has_children):
+        self.emit("%s%s%s%s%s\n" %
+                  (prefix, self.header_prefix, ConsoleRenderer.COLOR_HEADER, node.name, ConsoleRenderer.ENDCOL))
+        if has_children:
             data_prefix = prefix + self.indent_unit[:-1] + ConsoleRenderer.VERT + self.indent_unit
         else:
             data_prefix = prefix + self.indent_unit + self.indent_unit
         for attr in node.attrs:
             if attr.display_value != None:
-                write("%s%s%s%s: %s (%s)\n" % (data_prefix, ConsoleRenderer.COLOR_ATTR, attr.name,
-                                               ConsoleRenderer.ENDCOL, attr.value, attr.display_value))
+                self.emit("%s%s%s%s: %s (%s)\n" % (data_prefix, ConsoleRenderer.COLOR_ATTR, attr.name,
+                                                   ConsoleRenderer.ENDCOL, attr.value, attr.display_value))
             else:
-                write("%s%s%s%s: %s\n" %
-                      (data_prefix, ConsoleRenderer.COLOR_ATTR, attr.name, ConsoleRenderer.ENDCOL, attr.value))
-        child_indent = prefix + self.indent_unit[:-1] + ConsoleRenderer.VERT
-        for i in range(len(node.children)):
-            if i + 1 == len(node.children):
-                child_indent = prefix + self.indent_unit
-            self.show_node(node.children[i], child_indent)
+                self.emit("%s%s%s%s: %s\n" %
+                          (data_prefix, ConsoleRenderer.COLOR_ATTR, attr.name, ConsoleRenderer.ENDCOL, attr.value))
+
+    def show_node(self, node, prefix):
+        # Depth first with an explicit stack, so deep trees cannot hit the recursion limit
+        stack = [(node, prefix)]
+        while stack:
+            node, prefix = stack.pop()
+            children = node.children
+            self.show_header(node, prefix, len(children) > 0)
+            if len(children):
+                stack.append((children[-1], prefix + self.indent_unit))
+                child_indent = prefix + self.indent_unit[:-1] + ConsoleRenderer.VERT
+                for i in range(len(children) - 2, -1, -1):
+                    stack.append((children[i], child_indent))
 
     def render(self, tree):
         self.show_node(tree, self.offset)
+        self.flush()
+
+    def render_stream(self, tree, children, more=None):
+        """
+        Render tree with the nodes of the children iterable as its children, each as soon as it
+        is produced, e.g. by the parser. more, if given, tells whether another node may follow
+        without producing it, so a node is shown before the next one is parsed; otherwise one
+        node is looked ahead to know which one is the last.
+        """
+        if more is None:
+            children = iter(children)
+            child = next(children, None)
+            self.show_header(tree, self.offset, child is not None)
+            while child is not None:
+                following = next(children, None)
+                self.show_child(child, following is not None)
+                child = following
+        else:
+            self.show_header(tree, self.offset, more())
+            self.flush()
+            for child in children:
+                self.show_child(child, more())
+        self.flush()
+
+    def show_child(self, child, more):
+        if more:
+            self.show_node(child, self.offset + self.indent_unit[:-1] + ConsoleRenderer.VERT)
+        else:
+            self.show_node(child, self.offset + self.indent_unit)
+        self.flush()
 
     def updatecolors(self):
         if not sys.stdout.isatty():
@@ -1,5 +1,23 @@
+import mmap
 import os
+import stat
 import sys
+from array import array
+from collections import OrderedDict
+
+try:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.parse import urlsplit
+except ImportError:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urlparse import urlsplit
+
+# array typecodes for big-endian integers read with DataBuffer.readintarray,
+# keyed by (bytecount, signed); C type sizes vary by platform, so look them up.
+INT_ARRAY_TYPECODES = {}
+for _code in 'BHILQbhilq':
+    INT_ARRAY_TYPECODES.setdefault((array(_code).itemsize, _code.islower()), _code)
+del _code
 
 
 class FileSource(object):
@@ -14,27 +32,367 @@ class FileSource(object):
     def seek(self, count, pos):
         return self.file.seek(count, pos)
 
+    def refresh(self):
+        """Pick up the current size of a file that is still being written"""
+        self.size = os.fstat(self.file.fileno()).st_size
+        return self.size
+
+    def __len__(self):
+        return self.size
+
+
+class MmapSource(object):
+    """
+    Read-only memory map of a regular file. DataBuffer slices the mapping
+    directly through getview(), so refills and skips never copy or seek.
+    """
+
+    def __init__(self, f):
+        self.file = f
+        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        self.size = len(self.map)
+        self.pos = 0
+
+    def read(self, req_bytes):
+        data = self.map[self.pos:self.pos + req_bytes]
+        self.pos += len(data)
+        return data
+
+    def seek(self, count, pos):
+        if pos == os.SEEK_SET:
+            self.pos = count
+        elif pos == os.SEEK_CUR:
+            self.pos += count
+        else:
+            self.pos = self.size + count
+        return self.pos
+
+    def getview(self):
+        return self.view
+
+    def close(self):
+        """Unmap the file. Views still held into it keep the mapping alive; it goes with them."""
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            pass
+
     def __len__(self):
         return self.size
 
 
+class StreamSource(object):
+    """
+    Forward-only source for pipes, sockets and stdin. Reads return whatever is available
+    instead of waiting for the full request, and seeking forward reads and discards.
+    """
+    DISCARD_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, f):
+        self.file = f
+        self.pos = 0
+        self.read_available = f.read1 if hasattr(f, 'read1') else f.read
+
+    def read(self, req_bytes):
+        data = self.read_available(req_bytes)
+        self.pos += len(data)
+        return data
+
+    def seek(self, count, pos):
+        if pos == os.SEEK_SET:
+            target = count
+        elif pos == os.SEEK_CUR:
+            target = self.pos + count
+        else:
+            raise Exception("Cannot seek relative to the end of a stream")
+        if target < self.pos:
+            raise Exception("Cannot seek backwards in a stream: at %d, requested %d" % (self.pos, target))
+        while self.pos < target:
+            data = self.file.read(min(target - self.pos, StreamSource.DISCARD_CHUNK_SIZE))
+            if not len(data):
+                break
+            self.pos += len(data)
+        return self.pos
+
+    def __len__(self):
+        # The size of a stream is not known up front
+        return sys.maxsize
+
+
+class RangeSource(object):
+    """
+    Read-only source for a file behind an HTTP(S) URL, read with range requests.
+    Data is fetched in fixed size blocks kept in an LRU cache. Each run of missing
+    blocks is fetched with one request over a persistent connection, and reads that
+    continue where the previous one ended prefetch a growing number of blocks.
+    """
+    BLOCK_SIZE = 16 * 1024
+    CACHE_BLOCKS = 1024
+    MAX_PREFETCH_BLOCKS = 64
+    # Read-ahead limit for a DataBuffer on top, so that it does not ask for megabytes at a time
+    MAX_CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, url, block_size=None, cache_blocks=None, timeout=30):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise Exception("Unsupported URL scheme: %s" % url)
+        self.url = url
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.path = parts.path + ('?' + parts.query if parts.query else '')
+        self.timeout = timeout
+        self.block_size = block_size if block_size else RangeSource.BLOCK_SIZE
+        self.cache_blocks = cache_blocks if cache_blocks else RangeSource.CACHE_BLOCKS
+        self.cache = OrderedDict()
+        self.conn = None
+        self.max_chunk_size = RangeSource.MAX_CHUNK_SIZE
+        self.pos = 0
+        self.next_block = None
+        self.prefetch_blocks = 0
+        # Number of range requests sent and payload bytes they returned
+        self.requests = 0
+        self.bytes_fetched = 0
+        self.size = None
+        self.fetch(0, 0)
+
+    def connect(self):
+        conn_class = HTTPSConnection if self.scheme == 'https' else HTTPConnection
+        self.conn = conn_class(self.netloc, timeout=self.timeout)
+
+    def request(self, method, headers):
+        for attempt in range(2):
+            if self.conn is None:
+                self.connect()
+            try:
+                self.conn.request(method, self.path, headers=headers)
+                return self.conn.getresponse()
+            except (IOError, OSError, HTTPException) as e:
+                # Idle keep-alive connections get dropped by servers; reconnect once
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise Exception("%s request %s for %s failed: %s" % (method, headers, self.url, e))
+
+    def total_size(self, response):
+        """File size from the Content-Range of a range response, or from a HEAD request if it is 'bytes a-b/*'"""
+        total = (response.getheader('Content-Range') or '').rpartition('/')[2].strip()
+        if total.isdigit():
+            return int(total)
+        head = self.request('HEAD', {})
+        head.read()
+        length = head.getheader('Content-Length')
+        if head.status != 200 or length is None or not length.strip().isdigit():
+            raise Exception("Cannot tell the size of %s: Content-Range %r, HEAD gave HTTP %d and Content-Length %r" %
+                            (self.url, response.getheader('Content-Range'), head.status, length))
+        return int(length)
+
+    def fetch(self, first_block, last_block):
+        """Fetch blocks first_block..last_block (inclusive) with a single request; returns and caches them"""
+        first = first_block * self.block_size
+        last = (last_block + 1) * self.block_size - 1
+        if self.size is not None:
+            last = min(last, self.size - 1)
+        response = self.request('GET', {'Range': 'bytes=%d-%d' % (first, last)})
+        self.requests += 1
+        if response.status != 206:
+            # Leave the body, possibly the whole file, unread; the connection cannot be reused then
+            self.close()
+            raise Exception("Server does not support range requests for %s: HTTP %d %s" %
+                            (self.url, response.status, response.reason))
+        try:
+            data = response.read()
+        except (IOError, OSError, HTTPException) as e:
+            self.close()
+            raise Exception("Range request %d-%d for %s failed: %s" % (first, last, self.url, e))
+        self.bytes_fetched += len(data)
+        if self.size is None:
+            self.size = self.total_size(response)
+        blocks = []
+        for block in range(first_block, last_block + 1):
+            start = (block - first_block) * self.block_size
+            if start >= len(data):
+                break
+            blocks.append(data[start:start + self.block_size])
+            self.cache[block] = blocks[-1]
+            self.cache.move_to_end(block)
+        while len(self.cache) > self.cache_blocks:
+            self.cache.popitem(last=False)
+        return blocks
+
+    def read(self, req_bytes):
+        end = min(self.pos + req_bytes, self.size)
+        if self.pos >= end:
+            return b''
+        first_block = self.pos // self.block_size
+        last_block = (end - 1) // self.block_size
+        # Sequential access grows the prefetch window, a jump resets it
+        if first_block == self.next_block or first_block + 1 == self.next_block:
+            self.prefetch_blocks = min(max(1, self.prefetch_blocks * 2), RangeSource.MAX_PREFETCH_BLOCKS)
+        else:
+            self.prefetch_blocks = 0
+        self.next_block = last_block + 1
+        last_file_block = (self.size - 1) // self.block_size
+        fetch_last = min(last_block + self.prefetch_blocks, last_file_block)
+        pieces = []
+        block = first_block
+        while block <= fetch_last:
+            if block in self.cache:
+                self.cache.move_to_end(block)
+                if block <= last_block:
+                    pieces.append(self.cache[block])
+                block += 1
+                continue
+            # Coalesce the run of missing blocks into one request
+            run_start = block
+            while block <= fetch_last and block not in self.cache:
+                block += 1
+            pieces.extend(self.fetch(run_start, block - 1)[:max(0, last_block + 1 - run_start)])
+        start = self.pos - first_block * self.block_size
+        data = b''.join(pieces)[start:start + end - self.pos]
+        self.pos = end
+        return data
+
+    def seek(self, count, pos):
+        if pos == os.SEEK_SET:
+            self.pos = count
+        elif pos == os.SEEK_CUR:
+            self.pos += count
+        else:
+            self.pos = self.size + count
+        return self.pos
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __len__(self):
+        return self.size
+
+
+def open_source(f):
+    """
+    Return the cheapest source for an open binary file: mmap for non-empty regular files,
+    forward-only reads for pipes and sockets, plain reads otherwise
+    """
+    if not f.seekable():
+        return StreamSource(f)
+    st = os.fstat(f.fileno())
+    if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+        try:
+            return MmapSource(f)
+        except (ValueError, OSError):
+            pass
+    return FileSource(f)
+
+
+class BitReader(object):
+    """
+    MSB-first reader of a bitstream held in memory, such as the payload of a NAL unit. Bits are
+    served from an integer accumulator that is refilled eight bytes at a time, so reads of any
+    width cost a shift and a mask. Also decodes the Exp-Golomb codes of H.264/H.265 headers.
+    """
+    REFILL_BYTES = 8
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.acc = 0
+        self.bits = 0
+
+    def refill(self):
+        chunk = self.data[self.pos:self.pos + BitReader.REFILL_BYTES]
+        if not len(chunk):
+            raise Exception("Read beyond the end of the bitstream (%d bytes)" % len(self.data))
+        self.acc = self.acc << (8 * len(chunk)) | int.from_bytes(chunk, 'big')
+        self.bits += 8 * len(chunk)
+        self.pos += len(chunk)
+
+    def bits_left(self):
+        return self.bits + 8 * (len(self.data) - self.pos)
+
+    def read(self, bitcount):
+        while self.bits < bitcount:
+            self.refill()
+        self.bits -= bitcount
+        v = self.acc >> self.bits
+        self.acc &= (1 << self.bits) - 1
+        return v
+
+    def read_flag(self):
+        return self.read(1) == 1
+
+    def skip(self, bitcount):
+        while bitcount > self.bits:
+            bitcount -= self.bits
+            self.acc = 0
+            self.bits = 0
+            self.refill()
+        self.read(bitcount)
+
+    def read_ue(self):
+        """Unsigned Exp-Golomb code, ue(v)"""
+        zeros = 0
+        while True:
+            if not self.bits:
+                self.refill()
+            if self.acc:
+                # The accumulator holds no bits above self.bits, so this is the leading zero count
+                leading = self.bits - self.acc.bit_length()
+                zeros += leading
+                self.bits -= leading
+                break
+            zeros += self.bits
+            self.bits = 0
+        if zeros > 32:
+            raise Exception("Invalid Exp-Golomb code: %d leading zeros" % zeros)
+        return self.read(zeros + 1) - 1
+
+    def read_se(self):
+        """Signed Exp-Golomb code, se(v)"""
+        k = self.read_ue()
+        return (k + 1) // 2 if k & 1 else -(k // 2)
+
+
 class DataBuffer:
-    CHUNK_SIZE = 50
+    # Read-ahead window: starts small so that seek-heavy walks do not over-read,
+    # doubles on every sequential refill up to the maximum.
+    MIN_CHUNK_SIZE = 64 * 1024
+    MAX_CHUNK_SIZE = 4 * 1024 * 1024
 
-    def __init__(self, source):
+    def __init__(self, source, min_chunk_size=None, max_chunk_size=None):
         self.source = source
+        self.min_chunk_size = min_chunk_size if min_chunk_size else DataBuffer.MIN_CHUNK_SIZE
+        if not max_chunk_size:
+            # Sources where each read has a cost of its own (range requests) set a lower limit
+            max_chunk_size = getattr(source, 'max_chunk_size', DataBuffer.MAX_CHUNK_SIZE)
+        self.max_chunk_size = max(max_chunk_size, self.min_chunk_size)
+        self.chunk_size = self.min_chunk_size
+        # Number of source reads issued and bytes they returned
+        self.refills = 0
+        self.bytes_read = 0
+        # Sources that can hand out the whole file as a memoryview are read in place
+        self.view = source.getview() if hasattr(source, 'getview') else None
+        self.data = self.view if self.view is not None else bytearray()
         self.reset()
         self.readmore()
 
     def reset(self):
         self.bit_position = 0
         self.stream_offset = 0
-        self.buf_size = 0
         self.read_ptr = 0
-        self.data = b''
+        self.chunk_size = self.min_chunk_size
+        if self.view is not None:
+            self.buf_size = len(self.view)
+        else:
+            del self.data[:]
+            self.buf_size = 0
 
     def __str__(self):
-        return "<datasource size %d, readptr %d, offset %d>" % (self.buf_size, self.read_ptr, self.stream_offset)
+        return "<datasource size %d, readptr %d, offset %d, refills %d, read %d>" % (
+            self.buf_size, self.read_ptr, self.stream_offset, self.refills, self.bytes_read)
 
     def current_position(self):
         return self.stream_offset + self.read_ptr
@@ -43,29 +401,46 @@ class DataBuffer:
         return len(self.source) - (self.stream_offset + self.read_ptr)
 
     def readmore(self, minimum=0):
-        req_bytes = max(minimum, DataBuffer.CHUNK_SIZE)
-        data = self.source.read(req_bytes)
         remaining_bytes = self.buf_size - self.read_ptr
-        if len(data):
-            # print "Read %d" %(len(data))
-            self.data = b''.join([self.data[self.read_ptr:], data])
-            self.buf_size = remaining_bytes + len(data)
+        if self.view is not None:
+            # The whole file is already mapped; there is nothing more to read
+            if remaining_bytes <= 0:
+                raise Exception("Read nothing: req %d, offset %d, read_ptr %d" %
+                                (minimum, self.stream_offset, self.read_ptr))
+            if remaining_bytes < minimum:
+                raise Exception("Not enough data for %d bytes; remaining %d" % (minimum, remaining_bytes))
+            return
+        # Compact in place: drop the consumed prefix and keep the unread tail
+        if self.read_ptr:
+            del self.data[:self.read_ptr]
             self.stream_offset += self.read_ptr
             self.read_ptr = 0
-            if self.buf_size < minimum:
-                raise Exception("Not enough data for %d bytes; read %d, remaining %d", minimum, len(data),
-                                self.buf_size)
-        else:
-            # print "Min %d, size %d, pos %d, offset %d" %(
-            #    min, self.buf_size, self.read_ptr, self.stream_offset)
+        req_bytes = max(minimum, self.chunk_size)
+        read_bytes = 0
+        while read_bytes < req_bytes:
+            data = self.source.read(req_bytes - read_bytes)
+            self.refills += 1
+            if not len(data):
+                break
+            self.data += data
+            read_bytes += len(data)
+            if read_bytes >= minimum:
+                break
+        self.bytes_read += read_bytes
+        self.buf_size = remaining_bytes + read_bytes
+        self.chunk_size = min(self.chunk_size * 2, self.max_chunk_size)
+        if not read_bytes:
             raise Exception("Read nothing: req %d, offset %d, read_ptr %d" %
                             (minimum, self.stream_offset, self.read_ptr))
+        if read_bytes < minimum:
+            raise Exception("Not enough data for %d bytes; read %d, remaining %d" %
+                            (minimum, read_bytes, self.buf_size))
 
     def hasmore(self):
         if self.read_ptr == self.buf_size:
             try:
                 self.readmore()
-            except:
+            except Exception:
                 pass
         return self.read_ptr < self.buf_size
 
@@ -78,7 +453,7 @@ class DataBuffer:
             remaining_bytes = self.buf_size - self.read_ptr
 
         if remaining_bytes < length:
-            raise Exception("Attempt to read beyond buffer %d %d %d", self.read_ptr, self.buf_size, length)
+            raise Exception("Attempt to read beyond buffer %d %d %d" % (self.read_ptr, self.buf_size, length))
 
     def peekstr(self, length, offset=0):
         self.checkbuffer(length + offset)
@@ -99,7 +474,7 @@ class DataBuffer:
         if self.bit_position:
             raise Exception("Not aligned: %d" % self.bit_position)
         if sys.version_info > (3, 0):
-            return self.data[self.read_ptr + offset:self.read_ptr + offset + length]
+            return bytes(self.data[self.read_ptr + offset:self.read_ptr + offset + length])
         else:
             return self.data[self.read_ptr + offset:self.read_ptr + offset + length]
 
@@ -133,43 +508,27 @@ class DataBuffer:
         self.checkbuffer(bytecount)
         if self.bit_position:
             raise Exception("Not aligned: %d" % self.bit_position)
+        if sys.version_info > (3, 0):
+            return int.from_bytes(self.data[self.read_ptr:self.read_ptr + bytecount], 'big')
         v = 0
         for i in range(0, bytecount):
-            if sys.version_info > (3, 0):
-                data_byte = self.data[self.read_ptr + i]
-            else:
-                data_byte = ord(self.data[self.read_ptr + i])
-            v = v << 8 | data_byte
+            v = v << 8 | ord(self.data[self.read_ptr + i])
         return v
 
     def peekbits(self, bitcount):
-        bytes_req = (bitcount + self.bit_position) / 8
-        bytes_req += 1 if (bitcount + self.bit_position) % 8 else 0
-        self.checkbuffer(bytes_req)
         if bitcount > 32:
             raise Exception("%d bits?!! Use readint64() and do your own bit manipulations!" % (bitcount))
         if not (0 <= self.bit_position < 8):
             raise Exception("bit_position %d" % self.bit_position)
-        byte_offset = 0
-        bits_read = 0
-        result = 0
-        while bits_read != bitcount:
-            result <<= 8
-            if sys.version_info > (3, 0):
-                data_byte = self.data[self.read_ptr + byte_offset]
-            else:
-                data_byte = ord(self.data[self.read_ptr + byte_offset])
-            result |= data_byte
-            byte_offset += 1
-            if bits_read == 0 and self.bit_position != 0:
-                result &= (1 << (8 - self.bit_position)) - 1
-                bits_read += 8 - self.bit_position
-            else:
-                bits_read += 8
-            if bits_read > bitcount:
-                result >>= bits_read - bitcount
-                bits_read = bitcount
-        return result
+        bytes_req = (bitcount + self.bit_position + 7) // 8
+        self.checkbuffer(bytes_req)
+        if sys.version_info > (3, 0):
+            v = int.from_bytes(self.data[self.read_ptr:self.read_ptr + bytes_req], 'big')
+        else:
+            v = 0
+            for i in range(0, bytes_req):
+                v = v << 8 | ord(self.data[self.read_ptr + i])
+        return (v >> (bytes_req * 8 - self.bit_position - bitcount)) & ((1 << bitcount) - 1)
 
     def readbits(self, bitcount):
         res = self.peekbits(bitcount)
@@ -182,6 +541,19 @@ class DataBuffer:
         self.read_ptr += bytecount
         return v
 
+    def readintarray(self, bytecount, count, signed=False):
+        """Read count big-endian integers of bytecount bytes each into an array in one pass"""
+        length = bytecount * count
+        self.checkbuffer(length)
+        if self.bit_position:
+            raise Exception("Not aligned: %d" % self.bit_position)
+        values = array(INT_ARRAY_TYPECODES[(bytecount, signed)])
+        values.frombytes(self.data[self.read_ptr:self.read_ptr + length])
+        if sys.byteorder == 'little' and bytecount > 1:
+            values.byteswap()
+        self.read_ptr += length
+        return values
+
     def readbyte(self):
         return self.readint(1)
 
@@ -200,18 +572,27 @@ class DataBuffer:
         if count < 0:
             raise Exception("Negative bytes to skip %d" % (count))
         remaining_bytes = self.buf_size - self.read_ptr
-        if count < remaining_bytes:
+        if count < remaining_bytes or self.view is not None:
             self.read_ptr += count
         else:
             # TODO: would this seek beyond?
             self.source.seek(count - remaining_bytes, os.SEEK_CUR)
-            self.data = b''
+            del self.data[:]
             self.stream_offset += self.read_ptr + count
             self.buf_size = 0
             self.read_ptr = 0
+            self.chunk_size = self.min_chunk_size
 
     def seekto(self, pos):
+        # The buffer is refilled by the next read, so seeking to the end of the data is not an error
+        if self.view is not None:
+            self.bit_position = 0
+            self.read_ptr = pos
+            return
+        if self.stream_offset <= pos <= self.stream_offset + self.buf_size:
+            self.bit_position = 0
+            self.read_ptr = pos - self.stream_offset
+            return
         self.source.seek(pos, os.SEEK_SET)
         self.reset()
         self.stream_offset = pos
-        self.readmore()
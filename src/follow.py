@@ -0,0 +1,93 @@
+from __future__ import print_function
+import time
+
+from datasource import DataBuffer
+from datasource import FileSource
+
+
+class Follower(object):
+    """
+    Incremental parser for a file that is still being written, such as a live fragmented MP4.
+    Each poll() re-reads only the size of the file and parses the top level boxes that have
+    been completed since the previous poll, resuming right after the last complete box.
+    With a selection (see isobmff.selector) only the boxes on the way to a match are parsed.
+    Parsed moov and moof boxes are added to index (a FragmentIndex) if one is given.
+    """
+
+    def __init__(self, f, index=None, debug=False, selection=None):
+        # mmap sizes are fixed at map time, so growing files are read through plain reads
+        self.source = FileSource(f)
+        self.index = index
+        self.debug = debug
+        self.selection = selection
+        # Boxes of each type seen so far, for the [n] steps of the selection
+        self.counts = {}
+        self.buf = None
+        self.offset = 0
+
+    def next_box_end(self, size):
+        """End offset of the box at self.offset if all of it is on disk, else None"""
+        available = size - self.offset
+        if available < 8:
+            return None
+        box_size = self.buf.peekint(4)
+        if box_size == 1:
+            if available < 16:
+                return None
+            box_size = int.from_bytes(self.buf.peekbytes(16)[8:], 'big')
+        elif box_size == 0:
+            # Box runs to the end of the file, which is not known yet
+            return None
+        if box_size < 8:
+            raise Exception("Invalid box size %d at offset %d" % (box_size, self.offset))
+        end = self.offset + box_size
+        return end if end <= size else None
+
+    def poll(self):
+        """Parse and yield, one at a time, the top level boxes completed since the last call"""
+        from isobmff.box import Box
+        size = self.source.refresh()
+        if size < self.offset:
+            raise Exception("File shrank from %d to %d bytes" % (self.offset, size))
+        if self.buf is None:
+            if not size:
+                return
+            self.buf = DataBuffer(self.source)
+        while True:
+            end = self.next_box_end(size)
+            if end is None:
+                break
+            if self.selection is None:
+                box = Box.getnextbox(self.buf, None, self.debug)
+            else:
+                box = Box.getselectedbox(self.buf, None, self.selection, self.counts, None, self.debug)
+            self.offset = end
+            if box is None:
+                continue
+            if self.index is not None:
+                if box.boxtype == 'moov':
+                    self.index.set_moov(box)
+                elif box.boxtype == 'moof':
+                    self.index.add_moof(box)
+            yield box
+
+    def follow(self, interval=1.0, idle_timeout=None):
+        """
+        Yield top level boxes as they are completed, checking for new data every interval
+        seconds; stop once the file has not grown for idle_timeout seconds, or never if None
+        """
+        last_size = None
+        idle_since = time.time()
+        while True:
+            found = False
+            for box in self.poll():
+                found = True
+                yield box
+            now = time.time()
+            if len(self.source) != last_size:
+                last_size = len(self.source)
+                idle_since = now
+            elif idle_timeout is not None and now - idle_since >= idle_timeout:
+                return
+            if not found:
+                time.sleep(interval)
@@ -1,27 +1,46 @@
 #!/usr/bin/python
 
+import argparse
+
 import gi
 
 gi.require_version("Gtk", "3.0")
+from gi.repository import GLib
+from gi.repository import GObject
 from gi.repository import Gtk as gtk
 import xml.etree.ElementTree as ET
 
+from treeloader import TreeLoader, item_label
+
 
 class GtkRenderer(object):
+    # Item of the dummy row that gives a collapsed row its expander until the real rows are added
+    PLACEHOLDER = object()
+    # Item of the dummy row while the real rows are being decoded in the background
+    LOADING = object()
 
-    def __init__(self):
+    def __init__(self, args=None):
         w = gtk.Window()
         w.resize(1024, 768)
         w.connect("delete_event", self.on_delete)
         w.connect("destroy", self.on_destroy)
         self.window = w
+        # Formatting options for boxes that are turned into rows on expansion
+        self.args = args if args is not None else argparse.Namespace(truncate=True, depth=None)
+        self.loader = TreeLoader(GLib.idle_add, self.args)
 
     def on_delete(self, widget, event, data=None):
         return False
 
     def on_destroy(self, widget, data=None):
+        self.loader.cancel()
         gtk.main_quit()
 
+    def on_cancel(self, button):
+        # Stop loading; rows already shown can still be expanded
+        self.loader.stop()
+        button.set_sensitive(False)
+
     def format_node(self, name, value, istitle=False):
         root = ET.Element('markup')
         color = 'red' if istitle else 'blue'
@@ -31,31 +50,105 @@ class GtkRenderer(object):
         child.text = ": %s" % (value)
         return ET.tostring(root, encoding="unicode")
 
-    def populate(self, datanode, parent=None):
-        treenode = self.treestore.append(parent, [self.format_node(datanode.name, datanode.desc, True)])
-        for attr in datanode.attrs:
-            self.treestore.append(
-                treenode, [self.format_node(attr.name, attr.display_value if attr.display_value else attr.value)])
-        for child in datanode.children:
-            self.populate(child, treenode)
+    def add_item(self, item, parent=None):
+        """
+        Add a row for a Tree node or a Box. Its fields and children are only added when the row
+        is expanded, so a lazily parsed box is not even decoded until then.
+        """
+        name, desc, expandable = item_label(item)
+        row = self.treestore.append(parent, [self.format_node(name, desc, True), item])
+        if expandable:
+            self.treestore.append(row, ['', GtkRenderer.PLACEHOLDER])
+        return row
 
-    def render(self, data):
-        self.treestore = gtk.TreeStore(str)
+    def populate(self, row, fields, children):
+        for name, value in fields:
+            self.treestore.append(row, [self.format_node(name, value), None])
+        for child in children:
+            self.add_item(child, row)
+
+    def on_test_expand_row(self, treeview, row, path):
+        child = self.treestore.iter_children(row)
+        if child is not None and self.treestore.get_value(child, 1) is GtkRenderer.PLACEHOLDER:
+            # Decoded in the background; the row says so until the result arrives
+            self.treestore.set(child, [0, 1], ['<i>Loading...</i>', GtkRenderer.LOADING])
+            self.loader.expand(self.treestore.get_value(row, 1), self.on_expanded,
+                               gtk.TreeRowReference.new(self.treestore, path))
+        return False
+
+    def on_expanded(self, reference, fields, children, error):
+        if not reference.valid():
+            return False
+        row = self.treestore.get_iter(reference.get_path())
+        child = self.treestore.iter_children(row)
+        if child is not None and self.treestore.get_value(child, 1) is GtkRenderer.LOADING:
+            self.treestore.remove(child)
+        if error is not None:
+            self.treestore.append(row, [self.format_node("Error", error), None])
+        else:
+            self.populate(row, fields, children)
+        # Run once; idle_add would otherwise call again
+        return False
+
+    def create_view(self, title):
+        self.treestore = gtk.TreeStore(str, GObject.TYPE_PYOBJECT)
         self.treeview = gtk.TreeView(self.treestore)
+        self.treeview.connect("test-expand-row", self.on_test_expand_row)
 
-        col = gtk.TreeViewColumn(data.name)
+        col = gtk.TreeViewColumn(title)
         self.treeview.append_column(col)
         cell = gtk.CellRendererText()
         col.pack_start(cell, True)
         col.add_attribute(cell, 'markup', 0)
 
-        for child in data.children:
-            self.populate(child)
-
         sw = gtk.ScrolledWindow()
         sw.set_policy(gtk.PolicyType.AUTOMATIC, gtk.PolicyType.AUTOMATIC)
         sw.add(self.treeview)
-        self.window.add(sw)
-        self.treeview.expand_all()
+
+        self.progressbar = gtk.ProgressBar()
+        self.progressbar.set_show_text(True)
+        self.cancel_button = gtk.Button(label="Cancel")
+        self.cancel_button.connect("clicked", self.on_cancel)
+        self.statusbox = gtk.Box(orientation=gtk.Orientation.HORIZONTAL, spacing=6)
+        self.statusbox.pack_start(self.progressbar, True, True, 0)
+        self.statusbox.pack_start(self.cancel_button, False, False, 0)
+
+        vbox = gtk.Box(orientation=gtk.Orientation.VERTICAL)
+        vbox.pack_start(sw, True, True, 0)
+        vbox.pack_start(self.statusbox, False, False, 0)
+        return vbox
+
+    def add_batch(self, items, fraction, done, error):
+        for item in items:
+            self.add_item(item)
+        if done:
+            self.cancel_button.set_sensitive(False)
+            if error is not None:
+                self.progressbar.set_text("Error: %s" % error)
+            elif self.loader.stopped.is_set():
+                self.progressbar.set_text("Cancelled")
+            else:
+                self.statusbox.hide()
+        elif fraction is None:
+            self.progressbar.pulse()
+        else:
+            self.progressbar.set_fraction(min(fraction, 1.0))
+            self.progressbar.set_text("%d%%" % (fraction * 100))
+
+    def render(self, data):
+        self.render_boxes(data.name, data.children)
+
+    def render_boxes(self, title, items, progress=None):
+        """
+        Show top level Tree nodes or (preferably lazily parsed) boxes, all collapsed. The window
+        opens at once: items is consumed by a background TreeLoader, so a generator that parses
+        as it goes keeps the UI responsive, and rows appear as batches arrive. Expanded rows are
+        decoded in the background too. progress, if given, returns the fraction of the input
+        done so far.
+        """
+        self.window.add(self.create_view(title))
         self.window.show_all()
+        self.loader.start(items, self.add_batch, progress)
         gtk.main()
+        self.loader.cancel()
+        self.loader.join(1.0)
@@ -1,5 +1,9 @@
 from __future__ import print_function
 from __future__ import absolute_import
+import logging
+
+# Diagnostics about broken boxes, which are skipped; the application decides where they go
+logger = logging.getLogger('isobmff')
 
 
 def string_to_hex(s):
@@ -16,6 +20,8 @@ class Box(object):
         'moov': 'Movie container',
         'moof': 'Movie fragment',
         'mfra': 'Movie fragment random access',
+        'tfra': 'Track fragment random access',
+        'mfro': 'Movie fragment random access offset',
         'mfhd': 'Movie fragment header',
         'traf': 'Track fragment',
         'tfhd': 'Track fragment header',
@@ -41,6 +47,7 @@ class Box(object):
         'stts': 'Time-to-sample box',
         'stsc': 'Sample-to-chunk box',
         'stco': 'Chunk offset box',
+        'co64': 'Chunk large offset box',
         'stss': 'Sync sample box',
         'stsz': 'Sample size box',
         'stz2': 'Compact sample size box',
@@ -89,24 +96,57 @@ class Box(object):
         'schi',
     ]
 
-    def __init__(self, buf, parent=None, is_container=False, debug=False):
+    def __init__(self, buf, parent=None, is_container=False, debug=False, lazy=False, selection=None):
         self.parent = parent
+        # Selection the children are matched against; None parses all of them
+        self.selection = selection
         pos = buf.current_position()
         self.buffer_offset = pos
         self.has_children = is_container
         # has_children can be updated by parse() of the derived class
         self.debug = debug
+        self.lazy = lazy
+        self.loaded = not lazy
+        if lazy:
+            # Keep only the header; the payload is parsed by load() on first access
+            self.buf = buf
+            self.parse_header(buf)
+            buf.skipbytes(self.size - self.consumed_bytes)
+            self.consumed_bytes = self.size
+        else:
+            self.parse_box(buf)
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set yet, i.e. fields of a box that has not been loaded
+        if name.startswith('__') or self.__dict__.get('loaded', True):
+            raise AttributeError(name)
+        self.load()
+        return getattr(self, name)
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        pos = self.buf.current_position()
+        self.buf.seekto(self.buffer_offset)
+        try:
+            self.parse_box(self.buf)
+        finally:
+            self.buf.seekto(pos)
+
+    def parse_box(self, buf):
+        pos = self.buffer_offset
         self.parse(buf)
         self.consumed_bytes = buf.current_position() - pos
         if self.has_children:
             self.parse_children(buf)
         if self.consumed_bytes < self.size:
-            print("Skipping tailing bytes: Possible parse error (or unhandled box) in %s: consumed %d, skip %d" %
-                  (self, self.consumed_bytes, self.size - self.consumed_bytes))
+            logger.warning("Skipping tailing bytes: Possible parse error (or unhandled box) in %s: "
+                           "consumed %d, skip %d", self, self.consumed_bytes, self.size - self.consumed_bytes)
             buf.skipbytes(self.size - self.consumed_bytes)
             self.consumed_bytes = self.size
 
-    def parse(self, buf):
+    def parse_header(self, buf):
         islarge = False
         size = buf.readint32()
         boxtype = buf.readstr(4)
@@ -119,29 +159,42 @@ class Box(object):
 
         # Basic sanity check
         if self.parent is not None:
-            if self.parent.consumed_bytes + size > self.parent.size:
+            consumed = self.buffer_offset - self.parent.buffer_offset
+            if consumed + size > self.parent.size:
                 raise Exception("Size error: parent %d, consumed %d, child says %d" %
-                                (self.parent.size, self.parent.consumed_bytes, size))
+                                (self.parent.size, consumed, size))
 
         self.size = size
         self.boxtype = boxtype
         self.islarge = islarge
-        self.children = []
         # usertype
         if boxtype == 'uuid':
             buf.skipbytes(16)
             self.consumed_bytes += 16
 
+    def parse(self, buf):
+        self.parse_header(buf)
+        self.children = []
+
     def parse_children(self, buf):
+        counts = {}
         while self.consumed_bytes + 8 < self.size:
             try:
-                box = Box.getnextbox(buf, self)
+                if self.selection is None:
+                    box = Box.getnextbox(buf, self, lazy=self.lazy)
+                else:
+                    pos = buf.current_position()
+                    box = Box.getselectedbox(buf, self, self.selection, counts, self.buffer_offset + self.size,
+                                             lazy=self.lazy)
+                    if box is None:
+                        self.consumed_bytes += buf.current_position() - pos
+                        continue
                 self.children.append(box)
                 self.consumed_bytes += box.size
             except Exception as e:
                 if self.debug:
                     raise e
-                print("Error parsing children of %s: %s" % (self, e))
+                logger.error("Error parsing children of %s: %s", self, e)
                 buf.seekto(self.buffer_offset + self.size)
                 self.consumed_bytes = self.size
 
@@ -171,30 +224,108 @@ class Box(object):
         return "%s (%d bytes)" % (self.boxtype, self.size)
 
     @staticmethod
-    def getnextbox(buf, parent=None, debug=False):
-        from . import movie
-        from . import fragment
-        from . import flv
-        from . import cenc
-        boxmap = {
-            'ftyp': FileType,
-        }
-        boxmap.update(movie.boxmap)
-        boxmap.update(fragment.boxmap)
-        boxmap.update(flv.boxmap)
-        boxmap.update(cenc.boxmap)
-
-        fourcc = buf.peekstr(4, 4)
-        if fourcc in boxmap:
-            box = boxmap[fourcc](buf, parent)
+    def getnextbox(buf, parent=None, debug=False, lazy=False, selection=None):
+        if not box_registry:
+            load_box_registry()
+        fourcc = buf.peekbytes(4, 4)
+        if fourcc in box_registry:
+            box = box_registry[fourcc](buf, parent, lazy=lazy, selection=selection)
         else:
-            container = fourcc in Box.container_boxes
-            box = Box(buf, parent, container, debug)
+            container = fourcc in container_fourccs
+            box = Box(buf, parent, container, debug, lazy, selection)
             if not container:
                 #TODO: Handle size zero (box extends till EOF).
                 buf.skipbytes(box.size - box.consumed_bytes)
         return box
 
+    @staticmethod
+    def getselectedbox(buf, parent, selection, counts, end, debug=False, lazy=False):
+        """
+        Parse the next box if it or anything below it can match selection (see isobmff.selector);
+        otherwise skip it unparsed and return None, as for a box whose children all missed. counts
+        holds the number of boxes of each type seen so far among the siblings, and end is where the
+        parent ends (None for top level boxes).
+        """
+        boxtype = buf.peekbytes(4, 4).decode('latin-1')
+        index = counts.get(boxtype, 0)
+        counts[boxtype] = index + 1
+        matched, child_selection = selection.select(boxtype, index)
+        if matched:
+            return Box.getnextbox(buf, parent, debug, lazy)
+        if child_selection is not None:
+            box = Box.getnextbox(buf, parent, debug, lazy, child_selection)
+            # Leave out ancestors that turned out to hold no match; a lazy box is not parsed yet
+            if lazy or box.children:
+                return box
+            return None
+        size = buf.peekint(4)
+        if size == 1:
+            size = int.from_bytes(buf.peekbytes(16)[8:], 'big')
+        elif size == 0:
+            if end is None:
+                # Extends to the end of a file of unknown length: let the box skip itself
+                Box.getnextbox(buf, parent, debug, lazy)
+                return None
+            size = end - buf.current_position()
+        if size < 8:
+            raise Exception("Invalid size %d of %s box" % (size, boxtype))
+        buf.skipbytes(size)
+        return None
+
+    @staticmethod
+    def scan(source, offset=0, end=None, depth=0):
+        """
+        Walk the box hierarchy reading only box headers from source (anything with read, seek and len).
+        Recurses into container_boxes only and seeks over every payload. Yields a
+        (depth, boxtype, offset, size, error) tuple per box; error is None unless the header is broken,
+        in which case the walk of that level stops.
+        """
+        import os
+        if end is None:
+            end = len(source)
+        while offset + 8 <= end:
+            source.seek(offset, os.SEEK_SET)
+            header = source.read(16)
+            size = int.from_bytes(header[0:4], 'big')
+            boxtype = header[4:8].decode('latin-1')
+            header_size = 8
+            if size == 1:
+                if len(header) < 16:
+                    yield (depth, boxtype, offset, size, "truncated 64 bit size")
+                    return
+                size = int.from_bytes(header[8:16], 'big')
+                header_size = 16
+            elif size == 0:
+                # box extends till the end of the file
+                size = end - offset
+            if boxtype == 'uuid':
+                header_size += 16
+            if size < header_size:
+                yield (depth, boxtype, offset, size, "size smaller than header")
+                return
+            if offset + size > end:
+                yield (depth, boxtype, offset, size, "truncated: %d bytes missing" % (offset + size - end))
+                return
+            yield (depth, boxtype, offset, size, None)
+            if boxtype in Box.container_boxes:
+                child_offset = offset + header_size
+                if boxtype == 'meta':
+                    # iso meta is a full box, quicktime meta is not; version and flags are zero
+                    source.seek(child_offset, os.SEEK_SET)
+                    if source.read(4) == b'\0\0\0\0':
+                        child_offset += 4
+                for x in Box.scan(source, child_offset, offset + size, depth + 1):
+                    yield x
+            offset += size
+
+    @staticmethod
+    def generate_rows(count, format_row):
+        """
+        Yield a table of count rows, whose row i has the fields yielded by format_row(i). The rows
+        are formatted by whoever shows them, and only as many as it shows (see expand_rows).
+        """
+        yield Rows(count, format_row)
+
     @staticmethod
     def getboxdesc(name):
         if name in Box.box_names:
@@ -203,6 +334,33 @@ class Box(object):
             return name.upper()
 
 
+class Rows(object):
+    """Per-entry table among the fields of a box, yielded by Box.generate_rows"""
+
+    def __init__(self, count, format_row):
+        self.count = count
+        self.format_row = format_row
+
+    def fields(self, max_rows=None):
+        """Fields of the first max_rows rows (None for all of them), then how many were left out"""
+        shown = self.count if max_rows is None else min(self.count, max_rows)
+        for i in range(shown):
+            for field in self.format_row(i):
+                yield field
+        if shown < self.count:
+            yield ("  ...", "%d more" % (self.count - shown))
+
+
+def expand_rows(fields, max_rows=None):
+    """fields as yielded by generate_fields, with the fields of at most max_rows rows in place of each table"""
+    for field in fields:
+        if isinstance(field, Rows):
+            for row_field in field.fields(max_rows):
+                yield row_field
+        else:
+            yield field
+
+
 class FullBox(Box):
 
     def parse(self, buf):
@@ -239,3 +397,54 @@ class FileType(Box):
     def __str__(self):
         return super(FileType, self).__str__() + " %s %d with %d brands %s" % (self.major_brand, self.minor_version,
                                                                                len(self.brands), ','.join(self.brands))
+
+
+# Box parsers keyed by the raw four byte type, so dispatch needs no decoding.
+# Filled once by load_box_registry(); extended with register_box().
+box_registry = {}
+container_fourccs = frozenset()
+
+
+def load_box_registry():
+    global container_fourccs
+    if box_registry:
+        return
+    from . import movie
+    from . import fragment
+    from . import flv
+    from . import cenc
+    box_registry[b'ftyp'] = FileType
+    for boxmap in (movie.boxmap, fragment.boxmap, flv.boxmap, cenc.boxmap):
+        for fourcc, cls in boxmap.items():
+            box_registry[fourcc.encode('latin-1')] = cls
+    container_fourccs = frozenset(fourcc.encode('latin-1') for fourcc in Box.container_boxes)
+
+
+def register_box(fourcc, cls):
+    """Parse boxes of type fourcc (str or bytes) with cls, a Box subclass; replaces any built-in parser"""
+    if not isinstance(fourcc, bytes):
+        fourcc = fourcc.encode('latin-1')
+    if len(fourcc) != 4:
+        raise Exception("Box type should be four bytes, got %r" % fourcc)
+    load_box_registry()
+    box_registry[fourcc] = cls
+
+
+def iter_boxes(stream, debug=False, lazy=False, selection=None):
+    """
+    Yield the top level boxes of stream one at a time, each as soon as it has been parsed.
+    stream is a DataBuffer or a binary file object; pipes, sockets and stdin are read
+    forward only and box payloads that are not parsed are read and discarded.
+    With a selection (see isobmff.selector) only the boxes on the way to a match are parsed
+    and yielded; the others are skipped unparsed.
+    """
+    from datasource import DataBuffer, open_source
+    buf = stream if isinstance(stream, DataBuffer) else DataBuffer(open_source(stream))
+    counts = {}
+    while buf.hasmore():
+        if selection is None:
+            yield Box.getnextbox(buf, None, debug, lazy)
+        else:
+            box = Box.getselectedbox(buf, None, selection, counts, None, debug, lazy)
+            if box is not None:
+                yield box
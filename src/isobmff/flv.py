@@ -41,16 +41,20 @@ class AdobeFragmentRandomAccess(box.FullBox):
         yield ("Global entries present", self.global_entries_present)
         yield ("Timescale", self.timescale)
         yield ("Entry count", self.entry_count)
-        i = 0
-        for e in self.entries:
-            i += 1
-            yield ("  Entry %d" % (i), "time=%d, offset=%d" % e)
+
+        def entry_row(i):
+            yield ("  Entry %d" % (i + 1), "time=%d, offset=%d" % self.entries[i])
+
+        for x in self.generate_rows(len(self.entries), entry_row):
+            yield x
         if self.global_entries_present:
             yield ("Global entry count", self.global_entry_count)
-            i = 0
-            for e in self.global_entries:
-                i += 1
-                yield ("  Global entry %d" % (i), "time=%d, id=%d" % e)
+
+            def global_entry_row(i):
+                yield ("  Global entry %d" % (i + 1), "time=%d, id=%d" % self.global_entries[i])
+
+            for x in self.generate_rows(len(self.global_entries), global_entry_row):
+                yield x
 
 
 class AdobeBootstrap(box.FullBox):
@@ -133,10 +137,12 @@ class AdobeSegmentRunTable(box.FullBox):
         for q in self.quality_url_modifiers:
             yield ("Quality url modifier", q if len(q) else '<empty>')
         yield ("Segment entry count", self.segment_entry_count)
-        i = 0
-        for e in self.segment_entries:
-            i += 1
-            yield ("Entry %d" % (i), "First segment=%d, Fragments per segment=%d" % e)
+
+        def entry_row(i):
+            yield ("Entry %d" % (i + 1), "First segment=%d, Fragments per segment=%d" % self.segment_entries[i])
+
+        for x in self.generate_rows(len(self.segment_entries), entry_row):
+            yield x
 
 
 class AdobeFragmentRunTable(box.FullBox):
@@ -168,11 +174,14 @@ class AdobeFragmentRunTable(box.FullBox):
         for q in self.quality_url_modifiers:
             yield ("Quality url modifier", q if len(q) else '<empty>')
         yield ("Fragment entry count", self.fragment_entry_count)
-        i = 0
-        for e in self.fragment_entries:
-            i += 1
-            yield ("Entry %d" % (i),
-                   "first fragment=%d, first fragment timestamp=%d, fragment duration=%d, discontinuity=%d" % e)
+
+        def entry_row(i):
+            yield ("Entry %d" % (i + 1),
+                   "first fragment=%d, first fragment timestamp=%d, fragment duration=%d, discontinuity=%d" %
+                   self.fragment_entries[i])
+
+        for x in self.generate_rows(len(self.fragment_entries), entry_row):
+            yield x
 
 
 boxmap = {
@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
+from array import array
+
 from . import box
 
 
@@ -60,27 +62,30 @@ class TrackFragmentRun(box.FullBox):
             self.data_offset = buf.readint32()
         if self.flags & 0x000004:
             self.first_sample_flags = buf.readint32()
-        self.samples = []
-        for _ in range(self.sample_count):
-            dur = 0
-            size = 0
-            flags = 0
-            off = 0
-            if self.flags & 0x000100:
-                dur = buf.readint32()
-            if self.flags & 0x000200:
-                size = buf.readint32()
-            if self.flags & 0x000400:
-                flags = buf.readint32()
-            if self.flags & 0x000800:
-                if self.version == 0:
-                    off = buf.readint32()
-                else:
-                    #signed, so do the two's complement
-                    off = buf.readint32()
-                    if off & 0x80000000:
-                        off = -1 * ((off ^ 0xffffffff) + 1)
-            self.samples.append((dur, size, flags, off))
+        # Per-sample fields are all 32 bit: read the whole table at once and slice out the
+        # columns that the flags say are present; absent ones are None
+        present = [self.flags & flag != 0 for flag in (0x000100, 0x000200, 0x000400, 0x000800)]
+        stride = sum(present)
+        table = buf.readintarray(4, self.sample_count * stride) if stride else None
+        columns = []
+        column = 0
+        for is_present in present:
+            columns.append(table[column::stride] if is_present else None)
+            column += is_present
+        self.sample_durations, self.sample_sizes, self.sample_flags, self.sample_composition_offsets = columns
+        if self.version == 1 and self.sample_composition_offsets is not None:
+            # signed in version 1; reinterpret the unsigned column in bulk
+            offsets = array(self.sample_composition_offsets.typecode.lower())
+            offsets.frombytes(self.sample_composition_offsets.tobytes())
+            self.sample_composition_offsets = offsets
+
+    @property
+    def samples(self):
+        """(duration, size, flags, composition offset) of each sample, with 0 for absent fields"""
+        zeros = [0] * self.sample_count
+        columns = [zeros if c is None else c for c in (self.sample_durations, self.sample_sizes,
+                                                       self.sample_flags, self.sample_composition_offsets)]
+        return list(zip(*columns))
 
     def generate_fields(self):
         for x in super(TrackFragmentRun, self).generate_fields():
@@ -90,25 +95,21 @@ class TrackFragmentRun(box.FullBox):
             yield ('Data offset', self.data_offset)
         if self.flags & 0x000004:
             yield ('First sample flags', self.first_sample_flags)
-        i = 0
-        for s in self.samples:
-            i += 1
-            val = ""
-            if self.flags & 0x000100:
-                val += "duration=%d" % (s[0])
-            if self.flags & 0x000200:
-                if len(val):
-                    val += ", "
-                val += "size=%d" % (s[1])
-            if self.flags & 0x000400:
-                if len(val):
-                    val += ", "
-                val += "flags=0x%08x" % (s[2])
-            if self.flags & 0x000800:
-                if len(val):
-                    val += ", "
-                val += "compositional time offset=%d" % (s[3])
-            yield ('  Sample %d' % (i), val)
+        formats = []
+        columns = []
+        for column, fmt in ((self.sample_durations, "duration=%d"), (self.sample_sizes, "size=%d"),
+                            (self.sample_flags, "flags=0x%08x"),
+                            (self.sample_composition_offsets, "compositional time offset=%d")):
+            if column is not None:
+                formats.append(fmt)
+                columns.append(column)
+        fmt = ", ".join(formats)
+
+        def sample_row(i):
+            yield ('  Sample %d' % (i + 1), fmt % tuple(column[i] for column in columns))
+
+        for x in self.generate_rows(self.sample_count, sample_row):
+            yield x
 
 
 class SampleAuxInfoSizes(box.FullBox):
@@ -134,8 +135,12 @@ class SampleAuxInfoSizes(box.FullBox):
         if self.default_sample_info_size:
             yield ("Default sample info size", self.default_sample_info_size)
         else:
-            for sample in self.samples:
-                yield ("  Sample info size", sample)
+
+            def sample_row(i):
+                yield ("  Sample info size", self.samples[i])
+
+            for x in self.generate_rows(len(self.samples), sample_row):
+                yield x
 
 
 class SampleAuxInfoOffsets(box.FullBox):
@@ -161,8 +166,12 @@ class SampleAuxInfoOffsets(box.FullBox):
             yield ("Aux info type", self.aux_info_type)
             yield ("Aux info type parameter", self.aux_info_type_parameter)
         yield ("Entry Count", self.entry_count)
-        for offset in self.offsets:
-            yield ("  Offset", offset)
+
+        def offset_row(i):
+            yield ("  Offset", self.offsets[i])
+
+        for x in self.generate_rows(len(self.offsets), offset_row):
+            yield x
 
 
 class TrackFragmentDecodeTime(box.FullBox):
@@ -224,15 +233,67 @@ class SegmentIndexBox(box.FullBox):
         yield ('Earliest presentation time', self.earliest_presentation_time)
         yield ('First offset', self.first_offset)
         yield ('Reference count', self.reference_count)
-        i = 0
-        for ref in self.references:
-            i += 1
-            yield ('  Reference %d' % (i),
-                   'type=%d, size=%d, duration=%d, starts with SAP=%r, SAP type=%d, SAP delta time=%d' % ref)
+
+        def reference_row(i):
+            yield ('  Reference %d' % (i + 1),
+                   'type=%d, size=%d, duration=%d, starts with SAP=%r, SAP type=%d, SAP delta time=%d' %
+                   self.references[i])
+
+        for x in self.generate_rows(len(self.references), reference_row):
+            yield x
+
+
+class TrackFragmentRandomAccessBox(box.FullBox):
+
+    def parse(self, buf):
+        super(TrackFragmentRandomAccessBox, self).parse(buf)
+        self.track_id = buf.readint32()
+        val = buf.readint32()
+        self.traf_number_size = ((val >> 4) & 3) + 1
+        self.trun_number_size = ((val >> 2) & 3) + 1
+        self.sample_number_size = (val & 3) + 1
+        self.entry_count = buf.readint32()
+        time_size = 8 if self.version == 1 else 4
+        self.times = array('Q')
+        self.moof_offsets = array('Q')
+        self.traf_numbers = array('I')
+        self.trun_numbers = array('I')
+        self.sample_numbers = array('I')
+        for _ in range(self.entry_count):
+            self.times.append(buf.readint(time_size))
+            self.moof_offsets.append(buf.readint(time_size))
+            self.traf_numbers.append(buf.readint(self.traf_number_size))
+            self.trun_numbers.append(buf.readint(self.trun_number_size))
+            self.sample_numbers.append(buf.readint(self.sample_number_size))
+
+    def generate_fields(self):
+        for x in super(TrackFragmentRandomAccessBox, self).generate_fields():
+            yield x
+        yield ("Track id", self.track_id)
+        yield ("Traf number size", self.traf_number_size)
+        yield ("Trun number size", self.trun_number_size)
+        yield ("Sample number size", self.sample_number_size)
+        yield ("Entry count", self.entry_count)
+        yield ("Times", self.times)
+        yield ("Moof offsets", self.moof_offsets)
+        yield ("Traf numbers", self.traf_numbers)
+        yield ("Trun numbers", self.trun_numbers)
+        yield ("Sample numbers", self.sample_numbers)
+
+
+class MovieFragmentRandomAccessOffsetBox(box.FullBox):
+
+    def parse(self, buf):
+        super(MovieFragmentRandomAccessOffsetBox, self).parse(buf)
+        self.mfra_size = buf.readint32()
+
+    def generate_fields(self):
+        for x in super(MovieFragmentRandomAccessOffsetBox, self).generate_fields():
+            yield x
+        yield ("Mfra size", self.mfra_size)
 
 
 boxmap = {
-    #'mfra' : MovieFragmentRandomAccessBox
     'mfhd': MovieFragmentHeader,
     'tfhd': TrackFragmentHeader,
     'trun': TrackFragmentRun,
@@ -241,5 +302,7 @@ boxmap = {
     'tfdt': TrackFragmentDecodeTime,
     'styp': SegmentType,
     'sidx': SegmentIndexBox,
+    'tfra': TrackFragmentRandomAccessBox,
+    'mfro': MovieFragmentRandomAccessOffsetBox,
     #'ssix' : SubsegmentIndexBox,
 }
@@ -0,0 +1,476 @@
+from __future__ import absolute_import
+
+import io
+import operator
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+
+def find_box(box, path):
+    """Follow a path of box types such as 'mdia/minf/stbl' down from box; None if any step is missing"""
+    for boxtype in path.split('/'):
+        box = box.find_child(boxtype) if box is not None else None
+    return box
+
+
+class SampleIndex(object):
+    """
+    Per-sample view of a track, combined from its stts, stsc, stco/co64, stsz/stz2 and stss boxes.
+    File offset, size and decode time of every sample are held in flat arrays indexed by
+    sample number - 1; lookups by time, sample number or sync sample are bisects. Decode times
+    are in media timescale units; edit lists and composition offsets are not applied.
+    """
+
+    def __init__(self, trak):
+        tkhd = trak.find_child('tkhd')
+        mdhd = find_box(trak, 'mdia/mdhd')
+        stbl = find_box(trak, 'mdia/minf/stbl')
+        if mdhd is None or stbl is None:
+            raise Exception("Track has no media header or sample table")
+        self.track_id = tkhd.track_id if tkhd is not None else None
+        self.timescale = mdhd.timescale
+        stsz = stbl.find_child('stsz') or stbl.find_child('stz2')
+        stco = stbl.find_child('stco') or stbl.find_child('co64')
+        stts = stbl.find_child('stts')
+        stsc = stbl.find_child('stsc')
+        stss = stbl.find_child('stss')
+        if stsz is None or stco is None or stts is None or stsc is None:
+            raise Exception("Incomplete sample table in track %s" % self.track_id)
+
+        if stsz.boxtype == 'stsz' and stsz.sample_size:
+            self.sizes = array('I', [stsz.sample_size]) * stsz.sample_count
+        else:
+            self.sizes = array('I', stsz.entries)
+        self.sample_count = len(self.sizes)
+
+        # Decode time of each sample is the running sum of the stts deltas
+        deltas = array('I')
+        for count, delta in zip(stts.sample_counts, stts.sample_deltas):
+            deltas.extend(array('I', [delta]) * count)
+        del deltas[self.sample_count:]
+        # A truncated stts leaves the samples it does not cover at the time where it ends
+        deltas.extend(array('I', [0]) * (self.sample_count - len(deltas)))
+        self.decode_times = array('Q', accumulate(deltas, initial=0))
+        self.duration = self.decode_times.pop()
+
+        # Offset of a sample is the offset of its chunk plus the sizes of the samples before it
+        # in the chunk; with a per-chunk base of chunk offset - running size at the first
+        # sample of the chunk, that is base + running size of the sample.
+        running_sizes = array('Q', accumulate(self.sizes, initial=0))
+        chunk_offsets = stco.entries
+        chunk_count = len(chunk_offsets)
+        # Samples in each chunk, repeated out per stsc run, and the first sample of each chunk
+        chunk_samples = array('I')
+        runs = []
+        for i, first in enumerate(stsc.first_chunks):
+            last = stsc.first_chunks[i + 1] - 1 if i + 1 < len(stsc.first_chunks) else chunk_count
+            last = min(last, chunk_count)
+            chunk_samples.extend(array('I', [0]) * (first - 1 - len(chunk_samples)))
+            chunk_samples.extend(array('I', [stsc.samples_per_chunk[i]]) * (last - (first - 1)))
+            runs.append((first - 1, last, stsc.samples_per_chunk[i]))
+        first_samples = array('Q', accumulate(chunk_samples, initial=0))
+        if first_samples[-1] < self.sample_count:
+            raise Exception("Sample to chunk table of track %s covers %d of %d samples" %
+                            (self.track_id, first_samples[-1], self.sample_count))
+        used = bisect_left(first_samples, self.sample_count, 0, len(chunk_samples))
+        chunk_bases = array('q', map(operator.sub, chunk_offsets[:used],
+                                     map(running_sizes.__getitem__, first_samples[:used])))
+        # Within a run every chunk holds the same number of samples, so its bases are spread out
+        # with one strided slice per sample position in the chunk, or one fill per chunk when
+        # the chunks are fewer than that.
+        bases = array('q', [0]) * self.sample_count
+        for start_chunk, end_chunk, per_chunk in runs:
+            end_chunk = min(end_chunk, used)
+            if not per_chunk or start_chunk >= end_chunk:
+                continue
+            start = first_samples[start_chunk]
+            end = min(first_samples[end_chunk], self.sample_count)
+            if per_chunk <= end_chunk - start_chunk:
+                for i in range(per_chunk):
+                    count = len(range(start + i, end, per_chunk))
+                    bases[start + i:end:per_chunk] = chunk_bases[start_chunk:start_chunk + count]
+            else:
+                for chunk in range(start_chunk, end_chunk):
+                    sample = first_samples[chunk]
+                    count = min(per_chunk, end - sample)
+                    bases[sample:sample + count] = array('q', [chunk_bases[chunk]]) * count
+        self.offsets = array('Q', map(operator.add, bases, running_sizes))
+
+        # No stss means every sample is a sync sample
+        self.sync_samples = array('I', stss.entries) if stss is not None else None
+
+    def __len__(self):
+        return self.sample_count
+
+    def sample(self, number):
+        """(offset, size, decode time, is sync) of sample number (1-based)"""
+        if not 1 <= number <= self.sample_count:
+            raise IndexError("Sample %d out of range 1-%d" % (number, self.sample_count))
+        i = number - 1
+        return (self.offsets[i], self.sizes[i], self.decode_times[i], self.is_sync(number))
+
+    def is_sync(self, number):
+        if self.sync_samples is None:
+            return True
+        i = bisect_left(self.sync_samples, number)
+        return i < len(self.sync_samples) and self.sync_samples[i] == number
+
+    def sample_at(self, decode_time):
+        """Number of the sample being decoded at decode_time (timescale units); None before the first"""
+        i = bisect_right(self.decode_times, decode_time)
+        return i if i else None
+
+    def sample_at_seconds(self, seconds):
+        return self.sample_at(int(seconds * self.timescale))
+
+    def sync_sample_before(self, number):
+        """Closest sync sample at or before sample number, or None"""
+        if self.sync_samples is None:
+            return number
+        i = bisect_right(self.sync_samples, number)
+        return self.sync_samples[i - 1] if i else None
+
+    def sync_sample_after(self, number):
+        """Closest sync sample at or after sample number, or None"""
+        if self.sync_samples is None:
+            return number
+        i = bisect_left(self.sync_samples, number)
+        return self.sync_samples[i] if i < len(self.sync_samples) else None
+
+    @staticmethod
+    def from_boxes(boxes):
+        """SampleIndex of every track in the moov among the top level boxes, keyed by track id"""
+        indexes = {}
+        for box in boxes:
+            if box.boxtype != 'moov':
+                continue
+            for trak in box.children:
+                if trak.boxtype == 'trak':
+                    index = SampleIndex(trak)
+                    indexes[index.track_id] = index
+        return indexes
+
+
+def subsegment_ranges(source, start=0, end=None):
+    """
+    Byte ranges of the subsegments overlapping the window from start to end seconds (end None
+    for the end of the file), found through the sidx boxes of source. Hierarchical sidx chains
+    are followed into only the references that overlap the window, so apart from the top level
+    box headers up to the first sidx, only sidx boxes are read. Daisy chained sidx boxes, each
+    at the top level right after the subsegments of the one before, are followed until the
+    window ends. Returns a list of (offset, size, start, end) tuples with times in seconds,
+    empty if the file has no sidx.
+    """
+    from datasource import DataBuffer
+    from isobmff.box import Box
+    sidx_offset = None
+    for depth, boxtype, offset, size, error in Box.scan(source):
+        if error is not None or (depth == 0 and boxtype in ('moof', 'mdat')):
+            break
+        if depth == 0 and boxtype == 'sidx':
+            sidx_offset = offset
+            break
+    if sidx_offset is None:
+        return []
+    source.seek(0, os.SEEK_SET)
+    buf = DataBuffer(source)
+    ranges = []
+    while True:
+        following, time = add_subsegment_ranges(buf, sidx_offset, start, end, ranges)
+        if (end is not None and time >= end) or following + 8 > len(source):
+            break
+        buf.seekto(following)
+        if buf.peekbytes(4, 4) != b'sidx':
+            break
+        sidx_offset = following
+    return ranges
+
+
+def add_subsegment_ranges(buf, sidx_offset, start, end, ranges):
+    """
+    Add the ranges below the sidx at sidx_offset to ranges. Returns the offset right after the
+    last subsegment the sidx references, and the time (seconds) the window was followed up to.
+    """
+    from isobmff.box import Box
+    buf.seekto(sidx_offset)
+    sidx = Box.getnextbox(buf)
+    if sidx.boxtype != 'sidx':
+        raise Exception("Expected a sidx at offset %d, found %s" % (sidx_offset, sidx.boxtype))
+    # References are laid out back to back from the first byte after the sidx plus first_offset
+    first = sidx.buffer_offset + sidx.size + sidx.first_offset
+    offset = first
+    time = sidx.earliest_presentation_time
+    for ref_type, ref_size, ref_duration, _, _, _ in sidx.references:
+        ref_start = float(time) / sidx.timescale
+        ref_end = float(time + ref_duration) / sidx.timescale
+        if (end is None or ref_start < end) and ref_end > start:
+            if ref_type:
+                add_subsegment_ranges(buf, offset, start, end, ranges)
+            else:
+                ranges.append((offset, ref_size, ref_start, ref_end))
+        elif end is not None and ref_start >= end:
+            break
+        offset += ref_size
+        time += ref_duration
+    return first + sum(reference[1] for reference in sidx.references), float(time) / sidx.timescale
+
+
+class RandomAccessIndex(object):
+    """
+    Time to moof offset index of a fragmented file from the mfra box at its end. The trailing
+    mfro box gives the size of the mfra, so the index is read with two small reads and no
+    scan of the file. Times are in the media timescale of each track.
+    """
+
+    def __init__(self, mfra, mfra_offset):
+        self.mfra_offset = mfra_offset
+        self.tracks = {}
+        for tfra in mfra.children:
+            if tfra.boxtype == 'tfra':
+                self.tracks[tfra.track_id] = tfra
+
+    def moof_at(self, track_id, time):
+        """Offset of the moof with the last random access point at or before time; None before the first"""
+        tfra = self.tracks[track_id]
+        i = bisect_right(tfra.times, time)
+        return tfra.moof_offsets[i - 1] if i else None
+
+    def ranges(self, track_id, start, end, timescale):
+        """(offset, size, start, end) of the runs of fragments from start to end seconds, as subsegment_ranges"""
+        tfra = self.tracks[track_id]
+        # Several random access points may be in one moof; keep the first of each
+        moofs = []
+        for time, offset in zip(tfra.times, tfra.moof_offsets):
+            if not moofs or moofs[-1][1] != offset:
+                moofs.append((float(time) / timescale, offset))
+        ranges = []
+        for i, (range_start, offset) in enumerate(moofs):
+            if end is not None and range_start >= end:
+                break
+            if i + 1 < len(moofs):
+                range_end, next_offset = moofs[i + 1]
+            else:
+                range_end, next_offset = None, self.mfra_offset
+            if range_end is None or range_end > start:
+                ranges.append((offset, next_offset - offset, range_start, range_end))
+        return ranges
+
+    @staticmethod
+    def from_source(source):
+        """RandomAccessIndex of source (anything with read, seek and len), None if it has no mfra"""
+        from datasource import DataBuffer
+        from isobmff.box import Box
+        size = len(source)
+        if size < 16:
+            return None
+        source.seek(size - 16, os.SEEK_SET)
+        mfro = source.read(16)
+        if mfro[4:8] != b'mfro':
+            return None
+        mfra_size = int.from_bytes(mfro[12:16], 'big')
+        if not 16 <= mfra_size <= size:
+            return None
+        source.seek(size - mfra_size, os.SEEK_SET)
+        mfra = Box.getnextbox(DataBuffer(io.BytesIO(source.read(mfra_size))))
+        if mfra.boxtype != 'mfra':
+            return None
+        return RandomAccessIndex(mfra, size - mfra_size)
+
+
+def fragment_ranges(source, start=0, end=None):
+    """
+    Like subsegment_ranges, for files with an mfra instead of a sidx: byte ranges of the
+    fragments overlapping start to end seconds of the first track in the mfra. The moov is
+    read for the timescale of the track.
+    """
+    from datasource import DataBuffer
+    from isobmff.box import Box
+    index = RandomAccessIndex.from_source(source)
+    if index is None or not index.tracks:
+        return []
+    track_id = min(index.tracks)
+    moov_offset = None
+    for depth, boxtype, offset, size, error in Box.scan(source):
+        if error is not None or (depth == 0 and boxtype in ('moof', 'mdat')):
+            break
+        if depth == 0 and boxtype == 'moov':
+            moov_offset = offset
+            break
+    if moov_offset is None:
+        raise Exception("No moov to find the timescale of track %d in" % track_id)
+    source.seek(0, os.SEEK_SET)
+    buf = DataBuffer(source)
+    buf.seekto(moov_offset)
+    moov = Box.getnextbox(buf)
+    for trak in moov.children:
+        tkhd = trak.find_child('tkhd') if trak.boxtype == 'trak' else None
+        mdhd = find_box(trak, 'mdia/mdhd')
+        if tkhd is not None and mdhd is not None and tkhd.track_id == track_id:
+            return index.ranges(track_id, start, end, mdhd.timescale)
+    raise Exception("Track %d of the mfra is not in the moov" % track_id)
+
+
+# Sample flags bit telling that a sample is not a sync sample
+SAMPLE_IS_NON_SYNC = 0x00010000
+
+
+class TrackTimeline(object):
+    """
+    Columnar per-sample data of one track across all fragments, as resolved by FragmentIndex.
+    Samples are indexed from 0 in file order; fragment_starts holds the index of the first
+    sample of each fragment and moof_offsets the file offset of the moof it came from.
+    """
+
+    def __init__(self, track_id, timescale=None):
+        self.track_id = track_id
+        self.timescale = timescale
+        self.decode_times = array('Q')
+        self.durations = array('I')
+        self.sizes = array('I')
+        self.flags = array('I')
+        self.offsets = array('Q')
+        self.composition_offsets = array('q')
+        self.fragment_starts = array('Q')
+        self.fragment_times = array('Q')
+        self.moof_offsets = array('Q')
+        # Decode time at the end of the last sample, used when a traf has no tfdt
+        self.next_decode_time = 0
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def sample(self, i):
+        """(offset, size, decode time, duration, flags, composition offset) of sample i"""
+        return (self.offsets[i], self.sizes[i], self.decode_times[i], self.durations[i], self.flags[i],
+                self.composition_offsets[i])
+
+    def is_sync(self, i):
+        return not self.flags[i] & SAMPLE_IS_NON_SYNC
+
+    def sample_at(self, decode_time):
+        """Index of the sample being decoded at decode_time (timescale units); None before the first"""
+        i = bisect_right(self.decode_times, decode_time)
+        return i - 1 if i else None
+
+    def sample_at_seconds(self, seconds):
+        return self.sample_at(int(seconds * self.timescale))
+
+    def fragment_at(self, decode_time):
+        """Index of the fragment holding decode_time; None before the first"""
+        i = bisect_right(self.fragment_times, decode_time)
+        return i - 1 if i else None
+
+
+class FragmentIndex(object):
+    """
+    Timeline of a fragmented file built by walking every moof once. The effective duration,
+    size, flags, data offset and composition offset of each sample are resolved from the
+    trun, tfhd and trex (moov/mvex) defaults, with the base data offset rules of tfhd, and
+    decode times start from tfdt or continue from the previous fragment. Fragments can be
+    added one at a time with add_moof, e.g. while a file is still being written.
+    """
+
+    def __init__(self, moov=None):
+        self.trex = {}
+        self.timescales = {}
+        self.tracks = {}
+        if moov is not None:
+            self.set_moov(moov)
+
+    def set_moov(self, moov):
+        mvex = moov.find_child('mvex')
+        if mvex is not None:
+            for trex in mvex.children:
+                if trex.boxtype == 'trex':
+                    self.trex[trex.track_id] = trex
+        for trak in moov.children:
+            if trak.boxtype != 'trak':
+                continue
+            tkhd = trak.find_child('tkhd')
+            mdhd = find_box(trak, 'mdia/mdhd')
+            if tkhd is not None and mdhd is not None:
+                self.timescales[tkhd.track_id] = mdhd.timescale
+                if tkhd.track_id in self.tracks:
+                    self.tracks[tkhd.track_id].timescale = mdhd.timescale
+
+    def track(self, track_id):
+        if track_id not in self.tracks:
+            self.tracks[track_id] = TrackTimeline(track_id, self.timescales.get(track_id))
+        return self.tracks[track_id]
+
+    def add_moof(self, moof):
+        # Without an explicit base, the first traf starts at the moof and the others where
+        # the data of the previous traf ended
+        data_end = moof.buffer_offset
+        for traf in moof.children:
+            if traf.boxtype != 'traf':
+                continue
+            tfhd = traf.find_child('tfhd')
+            if tfhd is None:
+                continue
+            track = self.track(tfhd.track_id)
+            trex = self.trex.get(tfhd.track_id)
+            if tfhd.flags & 0x000001:
+                base = tfhd.base_data_offset
+            elif tfhd.default_base_is_moof:
+                base = moof.buffer_offset
+            else:
+                base = data_end
+            default_duration = tfhd.default_sample_duration if tfhd.flags & 0x000008 else (
+                trex.default_sample_duration if trex is not None else 0)
+            default_size = tfhd.default_sample_size if tfhd.flags & 0x000010 else (
+                trex.default_sample_size if trex is not None else 0)
+            default_flags = tfhd.default_sample_flags if tfhd.flags & 0x000020 else (
+                trex.default_sample_flags if trex is not None else 0)
+            tfdt = traf.find_child('tfdt')
+            decode_time = tfdt.decode_time if tfdt is not None else track.next_decode_time
+            track.fragment_starts.append(len(track))
+            track.fragment_times.append(decode_time)
+            track.moof_offsets.append(moof.buffer_offset)
+            data_offset = base
+            for trun in traf.children:
+                if trun.boxtype != 'trun':
+                    continue
+                if trun.flags & 0x000001:
+                    # data_offset is a signed 32 bit field, read as unsigned
+                    data_offset = base + trun.data_offset - ((trun.data_offset & 0x80000000) << 1)
+                count = trun.sample_count
+                durations = trun.sample_durations
+                if durations is None:
+                    durations = array('I', [default_duration]) * count
+                sizes = trun.sample_sizes
+                if sizes is None:
+                    sizes = array('I', [default_size]) * count
+                flags = trun.sample_flags
+                if flags is None:
+                    flags = array('I', [default_flags]) * count
+                    if count and trun.flags & 0x000004:
+                        flags[0] = trun.first_sample_flags
+                if trun.sample_composition_offsets is not None:
+                    track.composition_offsets.extend(array('q', trun.sample_composition_offsets))
+                else:
+                    track.composition_offsets.extend(array('q', [0]) * count)
+                times = array('Q', accumulate(durations, initial=decode_time))
+                decode_time = times.pop()
+                offsets = array('Q', accumulate(sizes, initial=data_offset))
+                data_offset = offsets.pop()
+                track.decode_times.extend(times)
+                track.durations.extend(durations)
+                track.sizes.extend(sizes)
+                track.flags.extend(flags)
+                track.offsets.extend(offsets)
+            track.next_decode_time = decode_time
+            data_end = data_offset
+
+    @staticmethod
+    def from_boxes(boxes):
+        """FragmentIndex of the moov and every moof among the top level boxes"""
+        index = FragmentIndex()
+        for box in boxes:
+            if box.boxtype == 'moov':
+                index.set_moov(box)
+            elif box.boxtype == 'moof':
+                index.add_moof(box)
+        return index
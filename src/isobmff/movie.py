@@ -1,7 +1,13 @@
 from __future__ import absolute_import
 
+from array import array
+
 from . import box
 
+# Translation tables splitting each byte of a 4 bit stz2 table into its high and low nibble
+HIGH_NIBBLES = bytes(i >> 4 for i in range(256))
+LOW_NIBBLES = bytes(i & 0xf for i in range(256))
+
 
 class MovieHeader(box.FullBox):
 
@@ -328,19 +334,25 @@ class TimeToSampleBox(box.FullBox):
     def parse(self, buf):
         super(TimeToSampleBox, self).parse(buf)
         self.entry_count = buf.readint32()
-        self.entries = []
-        for i in range(self.entry_count):
-            count = buf.readint32()
-            delta = buf.readint32()
-            self.entries.append((count, delta))
+        values = buf.readintarray(4, 2 * self.entry_count)
+        self.sample_counts = values[0::2]
+        self.sample_deltas = values[1::2]
+
+    @property
+    def entries(self):
+        return list(zip(self.sample_counts, self.sample_deltas))
 
     def generate_fields(self):
         for x in super(TimeToSampleBox, self).generate_fields():
             yield x
         yield ("entry count", self.entry_count)
-        for entry in self.entries:
-            yield ("sample count", entry[0])
-            yield ("sample delta", entry[1])
+
+        def entry_row(i):
+            yield ("sample count", self.sample_counts[i])
+            yield ("sample delta", self.sample_deltas[i])
+
+        for x in self.generate_rows(self.entry_count, entry_row):
+            yield x
 
 
 class SampleToChunkBox(box.FullBox):
@@ -348,29 +360,36 @@ class SampleToChunkBox(box.FullBox):
     def parse(self, buf):
         super(SampleToChunkBox, self).parse(buf)
         self.entry_count = buf.readint32()
-        self.entries = []
-        for i in range(self.entry_count):
-            first = buf.readint32()
-            samples_per_chunk = buf.readint32()
-            sdix = buf.readint32()
-            self.entries.append((first, samples_per_chunk, sdix))
+        values = buf.readintarray(4, 3 * self.entry_count)
+        self.first_chunks = values[0::3]
+        self.samples_per_chunk = values[1::3]
+        self.sample_description_indices = values[2::3]
+
+    @property
+    def entries(self):
+        return list(zip(self.first_chunks, self.samples_per_chunk, self.sample_description_indices))
 
     def generate_fields(self):
         for x in super(SampleToChunkBox, self).generate_fields():
             yield x
         yield ("entry count", self.entry_count)
-        for entry in self.entries:
-            yield ("first chunk", entry[0])
-            yield ("samples per chunk", entry[1])
-            yield ("sample description index", entry[2])
+
+        def entry_row(i):
+            yield ("first chunk", self.first_chunks[i])
+            yield ("samples per chunk", self.samples_per_chunk[i])
+            yield ("sample description index", self.sample_description_indices[i])
+
+        for x in self.generate_rows(self.entry_count, entry_row):
+            yield x
 
 
 class ChunkOffsetBox(box.FullBox):
+    offset_size = 4
 
     def parse(self, buf):
         super(ChunkOffsetBox, self).parse(buf)
         self.entry_count = buf.readint32()
-        self.entries = [buf.readint32() for i in range(self.entry_count)]
+        self.entries = buf.readintarray(self.offset_size, self.entry_count)
 
     def generate_fields(self):
         for x in super(ChunkOffsetBox, self).generate_fields():
@@ -379,12 +398,16 @@ class ChunkOffsetBox(box.FullBox):
         yield ("chunk offsets", self.entries)
 
 
+class ChunkLargeOffsetBox(ChunkOffsetBox):
+    offset_size = 8
+
+
 class SyncSampleBox(box.FullBox):
 
     def parse(self, buf):
         super(SyncSampleBox, self).parse(buf)
         self.entry_count = buf.readint32()
-        self.entries = [buf.readint32() for i in range(self.entry_count)]
+        self.entries = buf.readintarray(4, self.entry_count)
 
     def generate_fields(self):
         for x in super(SyncSampleBox, self).generate_fields():
@@ -399,10 +422,7 @@ class SampleSizeBox(box.FullBox):
         super(SampleSizeBox, self).parse(buf)
         self.sample_size = buf.readint32()
         self.sample_count = buf.readint32()
-        if self.sample_size == 0:
-            self.entries = [buf.readint32() for i in range(self.sample_count)]
-        else:
-            self.entries = []
+        self.entries = buf.readintarray(4, self.sample_count if self.sample_size == 0 else 0)
 
     def generate_fields(self):
         for x in super(SampleSizeBox, self).generate_fields():
@@ -420,15 +440,22 @@ class CompactSampleSizeBox(box.FullBox):
         buf.skipbytes(3)
         self.field_size = buf.readbyte()
         self.sample_count = buf.readint32()
-        self.entries = [buf.readbits(self.field_size) for i in range(self.sample_count)]
-        # skip padding bits
-        if self.field_size == 4 and self.sample_count % 2 != 0:
-            buf.readbits(4)
+        if self.field_size == 4:
+            # Two samples per byte, high nibble first; the last low nibble is padding if the count is odd
+            packed = buf.readbytes((self.sample_count + 1) // 2)
+            sizes = bytearray(len(packed) * 2)
+            sizes[0::2] = packed.translate(HIGH_NIBBLES)
+            sizes[1::2] = packed.translate(LOW_NIBBLES)
+            self.entries = array('B', sizes[:self.sample_count])
+        elif self.field_size in (8, 16):
+            self.entries = buf.readintarray(self.field_size // 8, self.sample_count)
+        else:
+            raise Exception("Invalid stz2 field size %d" % self.field_size)
 
     def generate_fields(self):
         for x in super(CompactSampleSizeBox, self).generate_fields():
             yield x
-        yield ("field size", self.sample_size)
+        yield ("field size", self.field_size)
         yield ("sample count", self.sample_count)
         yield ("entries", self.entries)
 
@@ -468,6 +495,88 @@ class TrackExtendsBox(box.FullBox):
         yield ("Default sample flags", self.default_sample_flags)
 
 
+class SequenceParameterSet(object):
+    """The fields of an H.264 sequence parameter set NAL unit up to the frame cropping (VUI is not parsed)"""
+    # profile_idc values whose SPS carries chroma format and bit depth
+    HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+    def __init__(self, nal):
+        from datasource import BitReader
+        # Strip emulation prevention bytes: 00 00 03 stands for 00 00
+        r = BitReader(bytes(nal).replace(b'\x00\x00\x03', b'\x00\x00'))
+        r.skip(8)
+        self.profile_idc = r.read(8)
+        self.constraint_flags = r.read(8)
+        self.level_idc = r.read(8)
+        self.seq_parameter_set_id = r.read_ue()
+        self.chroma_format_idc = 1
+        self.separate_colour_plane = False
+        self.bit_depth_luma = 8
+        self.bit_depth_chroma = 8
+        if self.profile_idc in SequenceParameterSet.HIGH_PROFILES:
+            self.chroma_format_idc = r.read_ue()
+            if self.chroma_format_idc == 3:
+                self.separate_colour_plane = r.read_flag()
+            self.bit_depth_luma = r.read_ue() + 8
+            self.bit_depth_chroma = r.read_ue() + 8
+            r.skip(1)
+            if r.read_flag():
+                for i in range(8 if self.chroma_format_idc != 3 else 12):
+                    if r.read_flag():
+                        self.skip_scaling_list(r, 16 if i < 6 else 64)
+        self.log2_max_frame_num = r.read_ue() + 4
+        self.pic_order_cnt_type = r.read_ue()
+        if self.pic_order_cnt_type == 0:
+            self.log2_max_pic_order_cnt_lsb = r.read_ue() + 4
+        elif self.pic_order_cnt_type == 1:
+            r.skip(1)
+            r.read_se()
+            r.read_se()
+            for _ in range(r.read_ue()):
+                r.read_se()
+        self.max_num_ref_frames = r.read_ue()
+        r.skip(1)
+        width_in_mbs = r.read_ue() + 1
+        height_in_map_units = r.read_ue() + 1
+        self.frame_mbs_only = r.read_flag()
+        if not self.frame_mbs_only:
+            r.skip(1)
+        r.skip(1)
+        crop = (r.read_ue(), r.read_ue(), r.read_ue(), r.read_ue()) if r.read_flag() else (0, 0, 0, 0)
+        # Cropping is in units of chroma samples, and of field lines for interlaced streams
+        if self.separate_colour_plane or self.chroma_format_idc == 0:
+            crop_x, crop_y = 1, 1
+        else:
+            crop_x = 2 if self.chroma_format_idc in (1, 2) else 1
+            crop_y = 2 if self.chroma_format_idc == 1 else 1
+        crop_y *= 2 - self.frame_mbs_only
+        self.width = width_in_mbs * 16 - crop_x * (crop[0] + crop[1])
+        self.height = height_in_map_units * 16 * (2 - self.frame_mbs_only) - crop_y * (crop[2] + crop[3])
+
+    @staticmethod
+    def skip_scaling_list(r, size):
+        last_scale = next_scale = 8
+        for _ in range(size):
+            if next_scale:
+                next_scale = (last_scale + r.read_se()) % 256
+            last_scale = next_scale or last_scale
+
+    def generate_fields(self):
+        yield ("  Profile idc", self.profile_idc)
+        yield ("  Constraint flags", "0x%02x" % self.constraint_flags)
+        yield ("  Level idc", self.level_idc)
+        yield ("  SPS id", self.seq_parameter_set_id)
+        yield ("  Chroma format idc", self.chroma_format_idc)
+        yield ("  Bit depth luma", self.bit_depth_luma)
+        yield ("  Bit depth chroma", self.bit_depth_chroma)
+        yield ("  Max frame num log2", self.log2_max_frame_num)
+        yield ("  Picture order count type", self.pic_order_cnt_type)
+        yield ("  Max ref frames", self.max_num_ref_frames)
+        yield ("  Frame MBs only", self.frame_mbs_only)
+        yield ("  Width", self.width)
+        yield ("  Height", self.height)
+
+
 class AvcCBox(box.Box):
 
     def parse(self, buf):
@@ -503,6 +612,12 @@ class AvcCBox(box.Box):
         yield ("Length size minus 1", self.len_minus_1)
         for sps in self.sps:
             yield ("SPS", sps.hex())
+            try:
+                fields = list(SequenceParameterSet(sps).generate_fields())
+            except Exception as e:
+                fields = [("  SPS parse error", str(e))]
+            for field in fields:
+                yield field
         for pps in self.pps:
             yield ("PPS", pps.hex())
 
@@ -520,6 +635,7 @@ boxmap = {
     'stts': TimeToSampleBox,
     'stsc': SampleToChunkBox,
     'stco': ChunkOffsetBox,
+    'co64': ChunkLargeOffsetBox,
     'stss': SyncSampleBox,
     'stsz': SampleSizeBox,
     'stz2': CompactSampleSizeBox,
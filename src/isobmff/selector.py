@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+
+import fnmatch
+import re
+
+from . import box
+
+STEP_PATTERN = re.compile(r'^(?P<name>[^\[\]/]+)(\[(?P<index>\*|[1-9][0-9]*)\])?$')
+
+
+class Selector(object):
+    """
+    Box path selectors such as 'moov/trak[*]/mdia/mdhd', 'moof/traf/tfdt' or '//pssh'. A step
+    is a box type, with shell-style wildcards, optionally followed by [n] to take only the
+    n-th box of that type among its siblings (counting from 1), or [*] for all of them. '//'
+    matches any number of levels of pure container boxes (Box.container_boxes) in between.
+    """
+    # Step that matches any number of container levels
+    DESCENDANT = None
+
+    def __init__(self, selectors):
+        self.paths = [Selector.compile(text) for text in selectors]
+
+    @staticmethod
+    def compile(text):
+        steps = []
+        rest = text
+        if rest.startswith('//'):
+            steps.append(Selector.DESCENDANT)
+            rest = rest[2:]
+        elif rest.startswith('/'):
+            rest = rest[1:]
+        for i, segment in enumerate(rest.split('//')):
+            if i:
+                steps.append(Selector.DESCENDANT)
+            for part in segment.split('/'):
+                match = STEP_PATTERN.match(part)
+                if match is None:
+                    raise Exception("Invalid step %r in selector %r" % (part, text))
+                index = match.group('index')
+                steps.append((match.group('name'), None if index in (None, '*') else int(index)))
+        return steps
+
+    def start(self):
+        """Selection for the top level boxes"""
+        return Selection(self, frozenset((path, 0) for path in range(len(self.paths))))
+
+
+class Selection(object):
+    """The steps of a Selector that the children of one box are matched against"""
+
+    def __init__(self, selector, states):
+        self.selector = selector
+        self.states = states
+
+    def select(self, boxtype, index):
+        """
+        Match a box of type boxtype, the index-th (from 0) of its type among its siblings.
+        Returns (matched, selection): matched if the box completes a selector and should be parsed
+        with all of its descendants; otherwise selection is the Selection for its children if
+        they could still match, or None if the box can be skipped unparsed.
+        """
+        matched = False
+        following = set()
+        for path, position in self.states:
+            steps = self.selector.paths[path]
+            step = steps[position]
+            if step is Selector.DESCENDANT:
+                # Stay on the descendant step for the children of containers, or match the next step here
+                if boxtype in box.Box.container_boxes:
+                    following.add((path, position))
+                position += 1
+                step = steps[position]
+            name, n = step
+            if fnmatch.fnmatchcase(boxtype, name) and (n is None or n == index + 1):
+                if position + 1 == len(steps):
+                    matched = True
+                else:
+                    following.add((path, position + 1))
+        return matched, Selection(self.selector, frozenset(following)) if following else None
@@ -0,0 +1,225 @@
+from __future__ import print_function
+import logging
+import sys
+import time
+import tracemalloc
+
+from datasource import DataBuffer, StreamSource
+from tree import Tree
+
+
+class BoxTypeStats(object):
+
+    def __init__(self):
+        self.parse_calls = 0
+        self.parse_seconds = 0.0
+        self.bytes = 0
+        self.fields_calls = 0
+        self.fields_seconds = 0.0
+
+
+class ParseProfiler(object):
+    """
+    Time spent per box type in parse_box() (parse() of the box itself, the time of its children
+    excluded) and in generate_fields(), the bytes each type accounts for, and the DataBuffer
+    calls that hit the source. The hooks replace methods of Box, its subclasses and DataBuffer
+    only between install() and uninstall(), so nothing is measured, or slowed down, otherwise.
+    """
+    # DataBuffer methods whose calls are counted
+    BUFFER_METHODS = ('readmore', 'seekto', 'skipbytes')
+
+    def __init__(self):
+        self.types = {}
+        self.buffer_calls = dict((name, 0) for name in ParseProfiler.BUFFER_METHODS)
+        # (name, seconds, tracemalloc peak in bytes) of each stage
+        self.stages = []
+        # Parse time of the children of the boxes being parsed, innermost last
+        self.parsing = []
+        # Boxes whose generate_fields() is being timed; super() calls inside it are not timed again
+        self.formatting = set()
+        self.patched = []
+
+    def stats(self, box):
+        boxtype = box.__dict__.get('boxtype', '????')
+        if boxtype not in self.types:
+            self.types[boxtype] = BoxTypeStats()
+        return self.types[boxtype]
+
+    def patch(self, cls, name, method):
+        self.patched.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, method)
+
+    def install(self):
+        from isobmff.box import Box, load_box_registry
+        load_box_registry()
+        profiler = self
+        parse_box = Box.parse_box
+
+        def timed_parse_box(box, buf):
+            children = [0.0]
+            profiler.parsing.append(children)
+            start = time.perf_counter()
+            try:
+                parse_box(box, buf)
+            finally:
+                elapsed = time.perf_counter() - start
+                profiler.parsing.pop()
+                if profiler.parsing:
+                    profiler.parsing[-1][0] += elapsed
+                stats = profiler.stats(box)
+                stats.parse_calls += 1
+                stats.parse_seconds += elapsed - children[0]
+                own = box.__dict__.get('size', 0) - sum(child.size for child in box.__dict__.get('children', ()))
+                stats.bytes += max(own, 0)
+
+        self.patch(Box, 'parse_box', timed_parse_box)
+
+        classes = [Box]
+        while classes:
+            cls = classes.pop()
+            classes.extend(cls.__subclasses__())
+            if 'generate_fields' in cls.__dict__:
+                self.patch(cls, 'generate_fields', self.timed_generate_fields(cls.__dict__['generate_fields']))
+
+        for name in ParseProfiler.BUFFER_METHODS:
+            self.patch(DataBuffer, name, self.counted(name, getattr(DataBuffer, name)))
+
+    def timed_generate_fields(self, generate_fields):
+        from isobmff.box import Rows
+        profiler = self
+
+        def timed(box):
+            if id(box) in profiler.formatting:
+                for field in generate_fields(box):
+                    yield field
+                return
+            profiler.formatting.add(id(box))
+            stats = profiler.stats(box)
+            stats.fields_calls += 1
+            fields = generate_fields(box)
+            try:
+                while True:
+                    # Only the time to produce each field; the consumer runs in between
+                    start = time.perf_counter()
+                    try:
+                        field = next(fields)
+                    except StopIteration:
+                        return
+                    finally:
+                        stats.fields_seconds += time.perf_counter() - start
+                    if isinstance(field, Rows):
+                        # Rows are formatted as they are shown, after generate_fields() is done with them
+                        field = Rows(field.count, profiler.timed_rows(field.format_row, stats))
+                    yield field
+            finally:
+                profiler.formatting.discard(id(box))
+
+        return timed
+
+    def timed_rows(self, format_row, stats):
+
+        def timed_row(i):
+            fields = format_row(i)
+            while True:
+                start = time.perf_counter()
+                try:
+                    field = next(fields)
+                except StopIteration:
+                    return
+                finally:
+                    stats.fields_seconds += time.perf_counter() - start
+                yield field
+
+        return timed_row
+
+    def counted(self, name, method):
+        calls = self.buffer_calls
+
+        def counted_method(*args, **kwargs):
+            calls[name] += 1
+            return method(*args, **kwargs)
+
+        return counted_method
+
+    def uninstall(self):
+        while self.patched:
+            cls, name, method = self.patched.pop()
+            setattr(cls, name, method)
+
+    def stage(self, name, function):
+        """Run function as the named stage, recording its wall time and allocation peak"""
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.clear_traces()
+        base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            return function()
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] - base
+            if not tracing:
+                tracemalloc.stop()
+            self.stages.append((name, elapsed, peak))
+
+    def report(self, buf=None, out=None):
+        out = out if out is not None else sys.stderr
+        out.write("\nProfile (times include tracemalloc overhead)\n")
+        out.write("%-8s %10s %12s\n" % ('stage', 'seconds', 'peak MB'))
+        for name, seconds, peak in self.stages:
+            out.write("%-8s %10.3f %12.2f\n" % (name, seconds, peak / 1048576.0))
+        calls = ', '.join('%d %s()' % (self.buffer_calls[name], name) for name in ParseProfiler.BUFFER_METHODS)
+        out.write("DataBuffer: %s" % calls)
+        if buf is not None:
+            out.write("; %d bytes in %d source reads" % (buf.bytes_read, buf.refills))
+        out.write("\n%-6s %8s %10s %12s %8s %10s %10s\n" %
+                  ('type', 'parsed', 'parse s', 'bytes', 'fields', 'fields s', 'total s'))
+        rows = sorted(self.types.items(), key=lambda item: item[1].parse_seconds + item[1].fields_seconds,
+                      reverse=True)
+        for boxtype, stats in rows:
+            out.write("%-6s %8d %10.4f %12d %8d %10.4f %10.4f\n" %
+                      (boxtype, stats.parse_calls, stats.parse_seconds, stats.bytes, stats.fields_calls,
+                       stats.fields_seconds, stats.parse_seconds + stats.fields_seconds))
+        out.flush()
+
+
+def profile_file(path, args, renderer):
+    """
+    Parse, format and render path as separate stages, so that each one gets its own time and
+    allocation peak, and print the profile to stderr
+    """
+    from isobmff.box import iter_boxes
+    from showboxes import add_box, get_selection, open_input
+    profiler = ParseProfiler()
+    profiler.install()
+    try:
+        with open_input(path) as (source, name):
+            buf = DataBuffer(source)
+            lazy = args.depth is not None and not isinstance(source, StreamSource)
+            boxes = []
+
+            def parse():
+                try:
+                    for box in iter_boxes(buf, args.debug, lazy, get_selection(args)):
+                        boxes.append(box)
+                except Exception:
+                    import traceback
+                    logging.getLogger('isobmff').error(traceback.format_exc())
+
+            def format_boxes():
+                root = Tree(name, "File")
+                for box in boxes:
+                    add_box(root, box, args)
+                return root
+
+            profiler.stage('parse', parse)
+            # Boxes parsed lazily, below -d, are parsed here and counted under their type all the same
+            root = profiler.stage('format', format_boxes)
+            profiler.stage('render', lambda: renderer.render(root))
+    finally:
+        profiler.uninstall()
+    profiler.report(buf)
@@ -0,0 +1,130 @@
+import json
+import struct
+import sys
+from array import array
+
+
+class JsonRenderer(object):
+    """
+    The tree as a single JSON document: the file object, whose children are written one top
+    level box at a time as they are parsed.
+    """
+
+    def __init__(self, out=None):
+        self.out = out if out is not None else sys.stdout.buffer
+
+    def encode(self, value):
+        return json.dumps(value, default=str, separators=(',', ':')).encode('utf-8')
+
+    def begin(self, tree):
+        head = {'name': tree.name, 'desc': tree.desc}
+        self.out.write(self.encode(head)[:-1] + b',"children":[')
+
+    def child(self, node, first):
+        self.out.write((b'\n' if first else b',\n') + self.encode(node.to_dict()))
+
+    def end(self, tree):
+        self.out.write(b']}\n')
+
+    def render_stream(self, tree, children, more=None):
+        # Nothing here depends on which child is the last, so more is not needed
+        self.begin(tree)
+        first = True
+        for node in children:
+            self.child(node, first)
+            first = False
+        self.end(tree)
+        self.out.flush()
+
+    def render(self, tree):
+        self.render_stream(tree, tree.children)
+
+
+class NdjsonRenderer(JsonRenderer):
+    """One JSON object per line for each top level box; the file itself is not written"""
+
+    def begin(self, tree):
+        pass
+
+    def child(self, node, first):
+        self.out.write(self.encode(node.to_dict()) + b'\n')
+
+    def end(self, tree):
+        pass
+
+
+def cbor_head(major, n):
+    if n < 24:
+        return struct.pack('>B', major << 5 | n)
+    if n < 0x100:
+        return struct.pack('>BB', major << 5 | 24, n)
+    if n < 0x10000:
+        return struct.pack('>BH', major << 5 | 25, n)
+    if n < 0x100000000:
+        return struct.pack('>BI', major << 5 | 26, n)
+    return struct.pack('>BQ', major << 5 | 27, n)
+
+
+def cbor_encode(value, out):
+    """Append the CBOR (RFC 8949) encoding of value to the bytearray out; unknown types are encoded as text"""
+    if value is None:
+        out.append(0xf6)
+    elif value is True or value is False:
+        out.append(0xf5 if value else 0xf4)
+    elif isinstance(value, int) and -(1 << 64) <= value < (1 << 64):
+        out += cbor_head(0, value) if value >= 0 else cbor_head(1, -1 - value)
+    elif isinstance(value, float):
+        out += struct.pack('>Bd', 0xfb, value)
+    elif isinstance(value, (bytes, bytearray)):
+        out += cbor_head(2, len(value))
+        out += value
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        out += cbor_head(3, len(data))
+        out += data
+    elif isinstance(value, (list, tuple, array)):
+        out += cbor_head(4, len(value))
+        for item in value:
+            cbor_encode(item, out)
+    elif isinstance(value, dict):
+        out += cbor_head(5, len(value))
+        for key, item in value.items():
+            cbor_encode(key, out)
+            cbor_encode(item, out)
+    else:
+        cbor_encode(str(value), out)
+
+
+class CborRenderer(JsonRenderer):
+    """
+    The tree as one CBOR map shaped like the JSON output. The children array has indefinite
+    length so that boxes can be written as they are parsed.
+    """
+
+    def encode(self, value):
+        out = bytearray()
+        cbor_encode(value, out)
+        return out
+
+    def begin(self, tree):
+        # Indefinite length map, closed in end()
+        out = bytearray(b'\xbf')
+        for key, value in (('name', tree.name), ('desc', tree.desc), ('children', None)):
+            cbor_encode(key, out)
+            if value is not None:
+                cbor_encode(value, out)
+        out.append(0x9f)
+        self.out.write(out)
+
+    def child(self, node, first):
+        self.out.write(self.encode(node.to_dict()))
+
+    def end(self, tree):
+        self.out.write(b'\xff\xff')
+
+
+RENDERERS = {
+    'json': JsonRenderer,
+    'ndjson': NdjsonRenderer,
+    'cbor': CborRenderer,
+}
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import signal
+import struct
+import tempfile
+import time
+
+from batch import init_worker, inspect_file
+from benchmarks.media import write_case
+from isobmff.box import FullBox
+from isobmff.box import register_box
+from tests.box_test import make_box
+
+
+class SlowBox(FullBox):
+
+    def parse(self, buf):
+        super(SlowBox, self).parse(buf)
+        time.sleep(5)
+
+
+class TimeoutTest(object):
+
+    def run(self):
+        if not hasattr(signal, 'SIGALRM'):
+            return
+        register_box('slow', SlowBox)
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            # The timeout fires two levels down, where parse_children handles broken boxes
+            f.write(make_box('moov', make_box('trak', make_box('slow', struct.pack('>I', 0), 0))))
+        args = argparse.Namespace(timeout=1, summary=False, debug=False, select=None, truncate=True, depth=None)
+        sigint = signal.getsignal(signal.SIGINT)
+        sigalrm = signal.getsignal(signal.SIGALRM)
+        try:
+            init_worker()
+            start = time.time()
+            failed, line = inspect_file((path, args))
+        finally:
+            signal.signal(signal.SIGINT, sigint)
+            signal.signal(signal.SIGALRM, sigalrm)
+            os.remove(path)
+        result = json.loads(line)
+        assert failed and result['error'] == "timed out after 1 seconds", "timeout not reported: %s" % line
+        assert time.time() - start < 4, "parsing went on after the timeout"
+
+
+class TruncatedFileTest(object):
+
+    def run(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            write_case('progressive', path, 0.001)
+            # The moov ends well past the cut
+            with open(path, 'r+b') as f:
+                f.truncate(1000)
+            for summary in (True, False):
+                args = argparse.Namespace(timeout=0, summary=summary, debug=False, select=None, truncate=True,
+                                          depth=None)
+                failed, line = inspect_file((path, args))
+                result = json.loads(line)
+                assert failed and 'error' in result, "truncated file passed (summary %s): %s" % (summary, line)
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    TimeoutTest().run()
+    TruncatedFileTest().run()
+    print("Success")
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+import io
+import os
+import struct
+import threading
+
+from datasource import BitReader
+from datasource import DataBuffer
+from isobmff.box import Box
+from isobmff.box import FullBox
+from isobmff.box import expand_rows
+from isobmff.box import iter_boxes
+from isobmff.box import register_box
+from isobmff.movie import SequenceParameterSet
+from isobmff.selector import Selector
+
+
+def make_box(boxtype, payload, version=None, flags=0):
+    if version is not None:
+        payload = struct.pack('>I', version << 24 | flags) + payload
+    return struct.pack('>I4s', 8 + len(payload), boxtype.encode('ascii')) + payload
+
+
+def parse_box(data):
+    return Box.getnextbox(DataBuffer(io.BytesIO(data)))
+
+
+class SampleTableTest(object):
+
+    def run(self):
+        sizes = [100 + i for i in range(1000)]
+        stsz = parse_box(make_box('stsz', struct.pack('>II', 0, len(sizes)) + struct.pack('>%dI' % len(sizes), *sizes),
+                                  0))
+        assert list(stsz.entries) == sizes, "stsz entries mismatch"
+
+        stco = parse_box(make_box('stco', struct.pack('>III', 2, 48, 0xFFFFFFF0), 0))
+        assert list(stco.entries) == [48, 0xFFFFFFF0], "stco entries %s" % stco.entries
+
+        co64 = parse_box(make_box('co64', struct.pack('>IQ', 1, 1 << 40), 0))
+        assert list(co64.entries) == [1 << 40], "co64 entries %s" % co64.entries
+
+        stts = parse_box(make_box('stts', struct.pack('>IIIII', 2, 10, 1000, 1, 500), 0))
+        assert stts.entries == [(10, 1000), (1, 500)], "stts entries %s" % stts.entries
+
+        stsc = parse_box(make_box('stsc', struct.pack('>IIIIIII', 2, 1, 5, 1, 3, 2, 1), 0))
+        assert stsc.entries == [(1, 5, 1), (3, 2, 1)], "stsc entries %s" % stsc.entries
+
+
+class TrackFragmentRunTest(object):
+
+    def run(self):
+        # Durations and signed composition offsets present; sizes and flags absent
+        samples = [(10, -20), (11, 0), (12, 40)]
+        payload = struct.pack('>Ii', 3, -8) + b''.join(struct.pack('>Ii', d, o) for d, o in samples)
+        trun = parse_box(make_box('trun', payload, 1, 0x000901))
+        assert trun.data_offset == 0xFFFFFFF8, "data offset %d" % trun.data_offset
+        assert list(trun.sample_durations) == [10, 11, 12], "durations %s" % trun.sample_durations
+        assert list(trun.sample_composition_offsets) == [-20, 0, 40], "offsets %s" % trun.sample_composition_offsets
+        assert trun.sample_sizes is None and trun.sample_flags is None, "absent columns"
+        assert trun.samples == [(10, 0, 0, -20), (11, 0, 0, 0), (12, 0, 0, 40)], "samples %s" % trun.samples
+
+        # Only rows within the display budget are formatted
+        rows = [field for field in expand_rows(trun.generate_fields(), 2) if field[0].startswith('  ')]
+        assert rows == [('  Sample 1', 'duration=10, compositional time offset=-20'),
+                        ('  Sample 2', 'duration=11, compositional time offset=0'), ('  ...', '1 more')], \
+            "budgeted rows %s" % rows
+
+        empty = parse_box(make_box('trun', struct.pack('>I', 2), 0, 0))
+        assert empty.samples == [(0, 0, 0, 0)] * 2, "samples without columns %s" % empty.samples
+
+
+def ue(value):
+    code = bin(value + 1)[2:]
+    return '0' * (len(code) - 1) + code
+
+
+class BitstreamTest(object):
+
+    def run(self):
+        reader = BitReader(bytes([0b10100110, 0b01000101, 0b10000000]))
+        assert [reader.read_ue() for _ in range(4)] == [0, 1, 2, 3], "ue"
+        assert reader.read_se() == 1 and reader.read_se() == 0 and reader.read(4) == 0b1000, "se"
+        assert reader.bits_left() == 4, "bits left %d" % reader.bits_left()
+
+        # 4 bit stz2 with an odd count, 8 and 16 bit ones
+        stz2 = parse_box(make_box('stz2', struct.pack('>II', 4, 5) + b'\x12\x34\x50', 0))
+        assert list(stz2.entries) == [1, 2, 3, 4, 5], "4 bit stz2 %s" % stz2.entries
+        stz2 = parse_box(make_box('stz2', struct.pack('>IIBB', 8, 2, 200, 7), 0))
+        assert list(stz2.entries) == [200, 7], "8 bit stz2 %s" % stz2.entries
+        stz2 = parse_box(make_box('stz2', struct.pack('>IIHH', 16, 2, 60000, 7), 0))
+        assert list(stz2.entries) == [60000, 7], "16 bit stz2 %s" % stz2.entries
+
+        # High profile 1920x1080 SPS, with level 0 and SPS id 63 so that 00 00 02 gets escaped
+        bits = ('01100111' + '01100100' + '00000000' + '00000000' + ue(63) + ue(1) + ue(0) + ue(0) + '00' + ue(0)
+                + ue(0) + ue(2) + ue(4) + '0' + ue(119) + ue(67) + '11' + '1' + ue(0) + ue(0) + ue(0) + ue(4) + '0'
+                + '1')
+        bits += '0' * (-len(bits) % 8)
+        nal = int(bits, 2).to_bytes(len(bits) // 8, 'big')
+        assert nal[2:5] == b'\x00\x00\x02', "SPS needs no emulation prevention"
+        nal = nal[:4] + b'\x03' + nal[4:]
+        sps = SequenceParameterSet(nal)
+        assert (sps.profile_idc, sps.seq_parameter_set_id, sps.chroma_format_idc) == (100, 63, 1), "SPS header"
+        assert (sps.width, sps.height) == (1920, 1080), "SPS size %dx%d" % (sps.width, sps.height)
+
+
+class LazyBoxTest(object):
+
+    def run(self):
+        stsz = make_box('stsz', struct.pack('>III', 0, 2, 7) + struct.pack('>I', 9), 0)
+        stbl = make_box('stbl', stsz)
+        buf = DataBuffer(io.BytesIO(stbl + make_box('free', b'')))
+        box = Box.getnextbox(buf, lazy=True)
+        assert not box.loaded, "stbl parsed eagerly"
+        assert buf.current_position() == len(stbl), "lazy box did not skip its payload"
+        child = box.children[0]
+        assert box.loaded and not child.loaded, "children should be headers only"
+        assert list(child.entries) == [7, 9], "stsz entries %s" % child.entries
+        assert buf.current_position() == len(stbl), "load() did not restore the read position"
+
+
+class CustomBox(FullBox):
+
+    def parse(self, buf):
+        super(CustomBox, self).parse(buf)
+        self.value = buf.readint32()
+
+
+class RegistryTest(object):
+
+    def run(self):
+        register_box('xmpl', CustomBox)
+        box = parse_box(make_box('moov', make_box('xmpl', struct.pack('>I', 42), 0)))
+        child = box.children[0]
+        assert isinstance(child, CustomBox) and child.value == 42, "custom box not dispatched: %s" % child
+
+
+class StreamTest(object):
+
+    def run(self):
+        read_fd, write_fd = os.pipe()
+        first_box_seen = threading.Event()
+        mdat_size = 3 * 1024 * 1024
+
+        def writer():
+            with os.fdopen(write_fd, 'wb') as f:
+                f.write(make_box('ftyp', b'isom' + struct.pack('>I', 0) + b'isom'))
+                f.flush()
+                # Only continue once the reader got ftyp: boxes must come out as they complete
+                first_box_seen.wait(10)
+                f.write(struct.pack('>I4s', 8 + mdat_size, b'mdat') + b'\0' * mdat_size)
+                f.write(make_box('free', b''))
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        with os.fdopen(read_fd, 'rb') as f:
+            boxes = iter_boxes(f)
+            first = next(boxes)
+            first_box_seen.set()
+            types = [first.boxtype] + [box.boxtype for box in boxes]
+        thread.join()
+        assert types == ['ftyp', 'mdat', 'free'], "stream boxes %s" % types
+
+
+class SelectorTest(object):
+
+    def types(self, box):
+        return [box.boxtype, [self.types(child) for child in box.children]]
+
+    def run(self):
+        trak1 = make_box('trak', make_box('mdia', make_box('abcd', b'1') + make_box('efgh', b'3')))
+        trak2 = make_box('trak', make_box('mdia', make_box('abcd', b'2')) + make_box('wxyz', b'4'))
+        moof = make_box('moof', make_box('traf', make_box('zzzz', b'5')) + make_box('yyyy', b'6'))
+        data = make_box('moov', trak1 + trak2) + make_box('free', b'') + moof + make_box('moof', b'7')
+        selection = Selector(['moov/trak[2]/mdia/abcd', '//zzzz']).start()
+        boxes = [self.types(box) for box in iter_boxes(DataBuffer(io.BytesIO(data)), selection=selection)]
+        assert boxes == [['moov', [['trak', [['mdia', [['abcd', []]]]]]]],
+                         ['moof', [['traf', [['zzzz', []]]]]]], "selected boxes %s" % boxes
+        selection = Selector(['moov/trak[*]']).start()
+        boxes = list(iter_boxes(DataBuffer(io.BytesIO(data)), selection=selection))
+        assert [len(box.children) for box in boxes] == [2], "trak[*] selected %s" % boxes
+        for text in ('moov/', 'moov/trak[0]', 'moov/[1]'):
+            try:
+                Selector([text])
+            except Exception:
+                continue
+            assert False, "invalid selector %r accepted" % text
+
+
+if __name__ == '__main__':
+    SampleTableTest().run()
+    TrackFragmentRunTest().run()
+    BitstreamTest().run()
+    LazyBoxTest().run()
+    RegistryTest().run()
+    StreamTest().run()
+    SelectorTest().run()
+    print("Success")
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+
+from cache import TreeCache
+from showboxes import cached_nodes, logger
+from tree import Tree
+
+
+class TreeCacheTest(object):
+
+    def run(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.check(directory)
+        finally:
+            shutil.rmtree(directory)
+
+    def check(self, directory):
+        media = os.path.join(directory, 'media.mp4')
+        with open(media, 'wb') as f:
+            f.write(b'\0' * 100)
+        cache = TreeCache(os.path.join(directory, 'cache'))
+        assert cache.load(media) is None, "hit on an empty cache"
+
+        tree = Tree('media.mp4', 'File')
+        tree.add_child('moov').add_attr('size', 8)
+        cache.store(media, tree)
+        cached = cache.load(media)
+        assert cached is not None and cached.children[0].attrs[0].value == 8, "cached tree mismatch"
+        assert cache.load(media, (False, None)) is None, "options are part of the key"
+
+        # Any change to the file invalidates the entry
+        with open(media, 'ab') as f:
+            f.write(b'\0')
+        assert cache.load(media) is None, "hit after the file changed"
+
+        # Least recently used entries go first once the size limit is hit
+        stale = os.path.join(cache.directory, os.listdir(cache.directory)[0])
+        os.utime(stale, (0, 0))
+        cache.max_size = os.path.getsize(stale)
+        cache.store(media, tree)
+        assert not os.path.exists(stale), "stale entry not evicted"
+        assert cache.load(media) is not None, "fresh entry evicted"
+
+        # Streamed nodes are stored once the last one is through, and not if the stream stops early
+        nodes = cached_nodes(iter([Tree('ftyp'), Tree('moov')]), Tree('media.mp4', 'File'), cache, media, 'stream')
+        next(nodes)
+        assert cache.load(media, 'stream') is None, "stored before the end"
+        list(nodes)
+        cached = cache.load(media, 'stream')
+        assert [node.name for node in cached.children] == ['ftyp', 'moov'], "streamed tree %s" % cached.children
+
+        # Trees whose parse logged errors are not stored
+        def broken():
+            yield Tree('ftyp')
+            logger.error("Error parsing children of moov")
+            yield Tree('moov')
+        logger.addHandler(logging.NullHandler())
+        list(cached_nodes(broken(), Tree('media.mp4', 'File'), cache, media, 'broken'))
+        assert cache.load(media, 'broken') is None, "stored a tree with parse errors"
+
+        # Entries that cannot be unpickled, for whatever reason, are misses and are removed
+        for data in (b'garbage', zlib.compress(b'\x80\x04\x95'),
+                     zlib.compress(pickle.dumps(Tree('media.mp4', 'File')).replace(b'Tree', b'Gone'))):
+            entry = cache.entry_path(media, 'damaged')
+            with open(entry, 'wb') as f:
+                f.write(data)
+            assert cache.load(media, 'damaged') is None, "hit on damaged entry %r" % data
+            assert not os.path.exists(entry), "damaged entry %r kept" % data
+
+
+if __name__ == '__main__':
+    TreeCacheTest().run()
+    print("Success")
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+import contextlib
+import io
+
+from console import ConsoleRenderer
+from tree import Tree
+
+
+def make_tree():
+    root = Tree('file', 'File')
+    for i in range(3):
+        box = root.add_child(Tree('box%d' % i))
+        box.add_attr('size', i * 8)
+        if i != 1:
+            box.add_child(Tree('child')).add_attr('value', 1, 'one')
+    return root
+
+
+def capture(render, *args):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        render(*args)
+    return out.getvalue()
+
+
+class ConsoleRendererTest(object):
+
+    def run(self):
+        renderer = ConsoleRenderer('  ')
+        renderer.disable_colors()
+        expected = ("  `---file\n"
+                    "     !`---box0\n"
+                    "     !   !    size: 0\n"
+                    "     !    `---child\n"
+                    "     !            value: 1 (one)\n"
+                    "     !`---box1\n"
+                    "     !        size: 8\n"
+                    "      `---box2\n"
+                    "         !    size: 16\n"
+                    "          `---child\n"
+                    "                  value: 1 (one)\n")
+        output = capture(renderer.render, make_tree())
+        assert output == expected, "render output:\n%s" % output
+
+        # Streaming the children gives the same output, last child included
+        tree = make_tree()
+        children = tree.children
+        tree.children = []
+        output = capture(renderer.render_stream, tree, iter(children))
+        assert output == expected, "render_stream output:\n%s" % output
+
+        # With more, each child is shown before the next one is taken
+        out = io.StringIO()
+        taken = []
+
+        def produce():
+            for child in children:
+                # Every child taken so far is on screen
+                assert out.getvalue().count('`---box') == len(taken), "box%d taken early" % len(taken)
+                taken.append(child)
+                yield child
+        with contextlib.redirect_stdout(out):
+            renderer.render_stream(tree, produce(), lambda: len(taken) < len(children))
+        assert out.getvalue() == expected, "render_stream output with more:\n%s" % out.getvalue()
+
+        # Nesting deeper than the recursion limit
+        root = node = Tree('root')
+        for i in range(5000):
+            node = node.add_child(Tree('n%d' % i))
+        assert len(capture(renderer.render, root).splitlines()) == 5001, "deep tree"
+
+
+if __name__ == '__main__':
+    ConsoleRendererTest().run()
+    print("Success")
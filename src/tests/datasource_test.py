@@ -1,17 +1,31 @@
 #!/usr/bin/python
 
 from __future__ import print_function
+import os
+import re
+import threading
+
 from datasource import DataBuffer
+from datasource import FileSource
+from datasource import MmapSource
+from datasource import RangeSource
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer as ThreadingHTTPServer
 
 
 class DataBufferTest(object):
 
-    def __init__(self, path):
+    def __init__(self, path, source_class=None, chunk_sizes=(None, None)):
         self.path = path
+        self.source_class = source_class
+        self.chunk_sizes = chunk_sizes
 
     def run(self):
         with open(self.path, 'rb') as f:
-            self.data_buffer = DataBuffer(f)
+            self.data_buffer = DataBuffer(self.source_class(f) if self.source_class else f, *self.chunk_sizes)
 
             actual = self.data_buffer.readint32()
             value = 0xA5A5A5A5
@@ -44,8 +58,136 @@ class DataBufferTest(object):
         assert actual == value, "Expected 0x%X, got 0x%X" % (value, actual)
 
 
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    data = bytes(bytearray(i * 7 % 251 for i in range(300000)))
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    # '/full' is served without range support, '/star' with an unknown size in Content-Range
+    def do_GET(self):
+        if self.path == '/full':
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(self.data)))
+            self.end_headers()
+            self.wfile.write(self.data)
+            return
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers['Range'])
+        first, last = int(match.group(1)), min(int(match.group(2)), len(self.data) - 1)
+        RangeRequestHandler.requests.append((self.client_address, first, last))
+        self.send_response(206)
+        total = '*' if self.path == '/star' else len(self.data)
+        self.send_header('Content-Range', 'bytes %d-%d/%s' % (first, last, total))
+        self.send_header('Content-Length', str(last - first + 1))
+        self.end_headers()
+        self.wfile.write(self.data[first:last + 1])
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.data)))
+        self.end_headers()
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        # Clients that drop a response they do not want reset the connection; that is expected
+        pass
+
+
+class RangeSourceTest(object):
+
+    def run(self):
+        server = QuietHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%d/' % server.server_address[1]
+            self.check(url + 'file')
+            self.check_size_fallback(url + 'star')
+            self.check_no_ranges(url + 'full')
+        finally:
+            server.shutdown()
+
+    def check(self, url):
+        data = RangeRequestHandler.data
+        source = RangeSource(url, block_size=1000, cache_blocks=50)
+        assert len(source) == len(data), "size %d" % len(source)
+
+        # Reads spanning several blocks are served by one coalesced request
+        source.seek(5500, os.SEEK_SET)
+        requests = source.requests
+        assert source.read(3000) == data[5500:8500], "read mismatch"
+        assert source.requests == requests + 1, "expected one request, sent %d" % (source.requests - requests)
+
+        # Cached blocks are not fetched again
+        source.seek(6000, os.SEEK_SET)
+        requests = source.requests
+        assert source.read(1000) == data[6000:7000], "cached read mismatch"
+        assert source.requests == requests, "cached read sent a request"
+
+        # Skipping far ahead and reading to the end
+        source.seek(-10, os.SEEK_END)
+        assert source.read(100) == data[-10:], "tail read mismatch"
+        assert source.read(100) == b'', "read beyond the end"
+
+        # A DataBuffer on top behaves as with a local file, over a single connection
+        source.seek(0, os.SEEK_SET)
+        buf = DataBuffer(source)
+        assert buf.readint32() == int.from_bytes(data[0:4], 'big'), "readint32 mismatch"
+        buf.skipbytes(200000)
+        assert buf.readbytes(16) == data[200004:200020], "read after skip mismatch"
+        clients = set(client for client, first, last in RangeRequestHandler.requests)
+        assert len(clients) == 1, "connection not reused: %d connections" % len(clients)
+        assert buf.max_chunk_size == RangeSource.MAX_CHUNK_SIZE, "read-ahead %d" % buf.max_chunk_size
+        source.close()
+
+    def check_size_fallback(self, url):
+        source = RangeSource(url, block_size=1000)
+        assert len(source) == len(RangeRequestHandler.data), "size from HEAD %d" % len(source)
+        assert source.read(10) == RangeRequestHandler.data[:10], "read mismatch"
+        source.close()
+
+    def check_no_ranges(self, url):
+        try:
+            RangeSource(url, block_size=1000)
+        except Exception as e:
+            assert 'HTTP 200' in str(e), "unexpected error %s" % e
+        else:
+            assert False, "a server without range support was accepted"
+
+
+class MmapSourceTest(object):
+
+    def run(self):
+        with open('tests/1.dat', 'rb') as f:
+            source = MmapSource(f)
+            buf = DataBuffer(source)
+            buf.readint32()
+            source.close()
+            assert source.map.closed, "mapping left open"
+
+            # A view still held keeps the mapping open instead of failing
+            source = MmapSource(f)
+            view = source.getview()[0:4]
+            source.close()
+            assert not source.map.closed and bytes(view) == b'\xa5' * 4, "mapping closed under a view"
+            view.release()
+
+
 if __name__ == '__main__':
     # The file is a sequence of 0xA5 bytes
-    dbt = DataBufferTest('tests/1.dat')
+    for source_class in (None, FileSource, MmapSource):
+        dbt = DataBufferTest('tests/1.dat', source_class)
+        dbt.run()
+    # Tiny read-ahead window to exercise compaction and window growth
+    dbt = DataBufferTest('tests/1.dat', FileSource, (5, 16))
     dbt.run()
+    assert dbt.data_buffer.refills > 1, "Expected several refills, got %d" % dbt.data_buffer.refills
+    MmapSourceTest().run()
+    RangeSourceTest().run()
     print("Success")
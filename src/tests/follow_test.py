@@ -0,0 +1,59 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+import os
+import tempfile
+
+from follow import Follower
+from isobmff.index import FragmentIndex
+from isobmff.selector import Selector
+from tests.box_test import make_box
+from tests.fragment_index_test import make_moov, make_traf
+
+
+class FollowTest(object):
+
+    def run(self):
+        moov = make_moov([1])
+        fragments = [make_box('moof', make_traf(1, [4, 4], i * 20)) + make_box('mdat', b'\0' * 8) for i in range(3)]
+        fd, path = tempfile.mkstemp()
+        try:
+            with open(path, 'wb', buffering=0) as writer, open(path, 'rb') as reader:
+                follower = Follower(reader, FragmentIndex())
+                assert list(follower.poll()) == [], "empty file"
+
+                # A box that is only partly written is left for the next poll
+                writer.write(moov + fragments[0][:10])
+                assert [box.boxtype for box in list(follower.poll())] == ['moov']
+                writer.write(fragments[0][10:] + fragments[1])
+                assert [box.boxtype for box in list(follower.poll())] == ['moof', 'mdat', 'moof', 'mdat']
+                assert list(follower.poll()) == [], "nothing new"
+
+                # Boxes come out one at a time, each parsed only when it is asked for
+                writer.write(fragments[2])
+                boxes = follower.poll()
+                assert next(boxes).boxtype == 'moof' and follower.offset < len(moov) + 3 * len(fragments[0]), \
+                    "parsed ahead to %d" % follower.offset
+                assert [box.boxtype for box in boxes] == ['mdat']
+                assert follower.offset == len(moov) + sum(len(f) for f in fragments), "offset %d" % follower.offset
+                track = follower.index.tracks[1]
+                assert list(track.decode_times) == [0, 10, 20, 30, 40, 50], "times %s" % track.decode_times
+
+                # Only the selected boxes are parsed
+                with open(path, 'rb') as again:
+                    boxes = list(Follower(again, selection=Selector(['moof/traf']).start()).poll())
+                assert [box.boxtype for box in boxes] == ['moof'] * 3, "selected %s" % boxes
+                assert [child.boxtype for child in boxes[0].children] == ['traf'], "children %s" % boxes[0].children
+
+                # follow() stops once the file stops growing
+                writer.write(fragments[0])
+                boxes = list(follower.follow(interval=0.01, idle_timeout=0.05))
+                assert [box.boxtype for box in boxes] == ['moof', 'mdat'], "follow %s" % boxes
+        finally:
+            os.close(fd)
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    FollowTest().run()
+    print("Success")
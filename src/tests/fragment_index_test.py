@@ -0,0 +1,188 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+import argparse
+import io
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+
+from datasource import DataBuffer, FileSource
+from isobmff.index import FragmentIndex, RandomAccessIndex, fragment_ranges, subsegment_ranges
+from showboxes import get_tree_for_time, getboxlist
+from tests.box_test import make_box
+
+
+def make_moov(track_ids):
+    traks = b''
+    trexs = b''
+    for track_id in track_ids:
+        tkhd = make_box('tkhd', struct.pack('>IIIII', 0, 0, track_id, 0, 0) + b'\0' * 60, 0)
+        mdhd = make_box('mdhd', struct.pack('>IIIIHH', 0, 0, 1000, 0, 0, 0), 0)
+        traks += make_box('trak', tkhd + make_box('mdia', mdhd))
+        # Defaults: duration 10, size 100, non-sync
+        trexs += make_box('trex', struct.pack('>IIIII', track_id, 1, 10, 100, 0x10000), 0)
+    return make_box('moov', traks + make_box('mvex', trexs))
+
+
+def make_traf(track_id, sizes, decode_time=None, first_sample_flags=None):
+    tfhd = make_box('tfhd', struct.pack('>I', track_id), 0)
+    tfdt = make_box('tfdt', struct.pack('>I', decode_time), 0) if decode_time is not None else b''
+    flags = 0x200
+    fields = struct.pack('>I', len(sizes))
+    if first_sample_flags is not None:
+        flags |= 0x4
+        fields += struct.pack('>I', first_sample_flags)
+    trun = make_box('trun', fields + b''.join(struct.pack('>I', s) for s in sizes), 0, flags)
+    return make_box('traf', tfhd + tfdt + trun)
+
+
+def make_sidx(earliest_time, references):
+    payload = struct.pack('>IIIIHH', 1, 10, earliest_time, 0, 0, len(references))
+    for ref_type, size, duration in references:
+        payload += struct.pack('>III', ref_type << 31 | size, duration, 0x90000000)
+    return make_box('sidx', payload, 0)
+
+
+class FragmentIndexTest(object):
+
+    def run(self):
+        moov = make_moov([1, 2])
+        # Two trafs without explicit base offsets: the first traf's data starts at the moof,
+        # the second's where the first's ended
+        moof = make_box('moof', make_traf(1, [5, 6], 0, 0) + make_traf(2, [7, 8, 9], 500))
+        moof2 = make_box('moof', make_traf(1, [1, 2]))
+        data = moov + moof + make_box('mdat', b'\0' * 35) + moof2 + make_box('mdat', b'\0' * 3)
+        index = FragmentIndex.from_boxes(getboxlist(DataBuffer(io.BytesIO(data))))
+
+        moof_offset = len(moov)
+        first = index.tracks[1]
+        assert list(first.sizes) == [5, 6, 1, 2], "sizes %s" % first.sizes
+        assert list(first.offsets[:2]) == [moof_offset, moof_offset + 5], "offsets %s" % first.offsets
+        # No tfdt in the second fragment: decode time carries on from the first
+        assert list(first.decode_times) == [0, 10, 20, 30], "times %s" % first.decode_times
+        assert first.is_sync(0) and not first.is_sync(1), "first sample flags"
+        assert list(first.moof_offsets) == [moof_offset, moof_offset + len(moof) + 43], "moofs %s" % first.moof_offsets
+        assert first.fragment_at(25) == 1 and first.sample_at(25) == 2, "lookups"
+
+        second = index.tracks[2]
+        assert list(second.offsets) == [moof_offset + 11, moof_offset + 18, moof_offset + 26], \
+            "offsets %s" % second.offsets
+        assert list(second.decode_times) == [500, 510, 520], "times %s" % second.decode_times
+        assert second.timescale == 1000 and second.sample_at(5) is None, "timescale and early lookup"
+
+        # Fragments can be added one at a time
+        grown = FragmentIndex.from_boxes(getboxlist(DataBuffer(io.BytesIO(moov + moof))))
+        assert len(grown.tracks[1]) == 2
+        grown.add_moof(getboxlist(DataBuffer(io.BytesIO(data)))[3])
+        assert list(grown.tracks[1].decode_times) == list(first.decode_times), "incremental add"
+
+
+def file_source(data):
+    f = tempfile.TemporaryFile()
+    f.write(data)
+    f.seek(0)
+    return FileSource(f)
+
+
+class SubsegmentRangesTest(object):
+
+    def run(self):
+        # A top level sidx pointing at two sidx of two 1 second subsegments each
+        segments = [make_box('mdat', b'\0' * (10 + i)) for i in range(4)]
+        children = []
+        for i in (0, 2):
+            sidx = make_sidx(i * 10, [(0, len(segments[i]), 10), (0, len(segments[i + 1]), 10)])
+            children.append(sidx + segments[i] + segments[i + 1])
+        top = make_sidx(0, [(1, len(children[0]), 20), (1, len(children[1]), 20)])
+        ftyp = make_box('ftyp', b'isom\0\0\0\0')
+        data = ftyp + top + b''.join(children)
+
+        source = file_source(data)
+        ranges = subsegment_ranges(source)
+        assert [r[1] for r in ranges] == [len(s) for s in segments], "ranges %s" % ranges
+        for offset, size, start, end in ranges:
+            assert data[offset + 4:offset + 8] == b'mdat', "range at %d is not a subsegment" % offset
+
+        # 1.5 to 2.5 seconds overlaps the second and third subsegments only
+        window = subsegment_ranges(source, 1.5, 2.5)
+        assert window == ranges[1:3], "window %s" % window
+        assert window[0][2:] == (1.0, 2.0), "times %s" % (window[0], )
+        assert subsegment_ranges(source, 5) == [], "past the end"
+        assert subsegment_ranges(file_source(ftyp + segments[0])) == [], "no sidx"
+
+        # The same two sidx daisy chained at the top level, each before its own subsegments
+        chained = file_source(ftyp + b''.join(children))
+        assert [r[1:] for r in subsegment_ranges(chained)] == [r[1:] for r in ranges], "chained"
+        assert [r[2:] for r in subsegment_ranges(chained, 1.5, 2.5)] == [r[2:] for r in window], "chained window"
+        assert len(subsegment_ranges(chained, 0, 0.5)) == 1, "window in the first sidx"
+
+
+class RandomAccessIndexTest(object):
+
+    def run(self):
+        moov = make_moov([1])
+        fragments = [make_box('moof', make_traf(1, [4, 4], i * 2000)) + make_box('mdat', b'\0' * 8) for i in range(3)]
+        offsets = [len(moov) + sum(len(f) for f in fragments[:i]) for i in range(3)]
+        # Two random access points in the second fragment
+        entries = [(0, offsets[0]), (2000, offsets[1]), (3000, offsets[1]), (4000, offsets[2])]
+        tfra = make_box('tfra', struct.pack('>III', 1, 0, len(entries))
+                        + b''.join(struct.pack('>IIBBB', t, o, 1, 1, 1) for t, o in entries), 0)
+        mfro = make_box('mfro', struct.pack('>I', len(tfra) + 24), 0)
+        mfra = make_box('mfra', tfra + mfro)
+        data = moov + b''.join(fragments) + mfra
+
+        source = file_source(data)
+        index = RandomAccessIndex.from_source(source)
+        assert index.mfra_offset == len(data) - len(mfra), "mfra offset %d" % index.mfra_offset
+        assert list(index.tracks[1].moof_offsets) == [o for t, o in entries], "tfra %s" % index.tracks[1].moof_offsets
+        assert index.moof_at(1, 3500) == offsets[1] and index.moof_at(1, 4000) == offsets[2], "moof_at"
+
+        # mdhd timescale is 1000: fragments start at 0, 2 and 4 seconds
+        ranges = fragment_ranges(source, 2.5, 4.5)
+        assert ranges == [(offsets[1], len(fragments[1]), 2.0, 4.0), (offsets[2], len(fragments[2]), 4.0, None)], \
+            "ranges %s" % ranges
+        assert fragment_ranges(source, 0, 1) == [(offsets[0], len(fragments[0]), 0.0, 2.0)], "first fragment"
+        assert RandomAccessIndex.from_source(file_source(data[:-len(mfra)])) is None, "no mfra"
+
+        # --select applies within the window: the moof of the second and third fragments, their mdat left out
+        args = argparse.Namespace(time=(2.5, 4.5), select=['moof/traf'], debug=False, truncate=True, depth=None)
+        root = get_tree_for_time(file_source(data), 'test', args)
+        assert [node.name for node in root.children] == ['moof', 'moof'], "boxes %s" % root.children
+        assert [[child.name for child in node.children] for node in root.children] == [['traf'], ['traf']], \
+            "children %s" % root.children
+
+
+class TimeErrorsTest(object):
+    """--time on input it cannot look times up in ends with a message, not a traceback"""
+
+    def showboxes(self, args, data=None):
+        process = subprocess.run([sys.executable, 'showboxes.py', '-c', 'off', '--time', '0-1'] + args,
+                                 input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return process.returncode, process.stdout.decode('utf-8') + process.stderr.decode('utf-8')
+
+    def run(self):
+        data = make_moov([1]) + make_box('moof', make_traf(1, [4], 0)) + make_box('mdat', b'\0' * 4)
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            code, output = self.showboxes([path])
+        finally:
+            os.remove(path)
+        assert code == 1 and 'has no segment index' in output and 'Traceback' not in output, \
+            "no index: %d %s" % (code, output)
+
+        code, output = self.showboxes(['-'], data)
+        assert code == 2 and 'needs a seekable input' in output and 'Traceback' not in output, \
+            "pipe: %d %s" % (code, output)
+
+
+if __name__ == '__main__':
+    FragmentIndexTest().run()
+    SubsegmentRangesTest().run()
+    RandomAccessIndexTest().run()
+    TimeErrorsTest().run()
+    print("Success")
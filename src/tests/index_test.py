@@ -0,0 +1,69 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+import io
+import struct
+
+from datasource import DataBuffer
+from isobmff.box import Box
+from isobmff.index import SampleIndex
+from tests.box_test import make_box
+
+
+def make_trak(sizes, deltas, samples_per_chunk, chunk_offsets, sync_samples):
+    tkhd = make_box('tkhd', struct.pack('>IIIII', 0, 0, 7, 0, 0) + b'\0' * 60, 0)
+    mdhd = make_box('mdhd', struct.pack('>IIIIHH', 0, 0, 1000, 0, 0, 0), 0)
+    stts = make_box('stts', struct.pack('>I', len(deltas)) + b''.join(struct.pack('>II', c, d) for c, d in deltas), 0)
+    stsc = make_box('stsc', struct.pack('>I', len(samples_per_chunk))
+                    + b''.join(struct.pack('>III', f, n, 1) for f, n in samples_per_chunk), 0)
+    stsz = make_box('stsz', struct.pack('>II', 0, len(sizes)) + struct.pack('>%dI' % len(sizes), *sizes), 0)
+    stco = make_box('stco', struct.pack('>I', len(chunk_offsets))
+                    + struct.pack('>%dI' % len(chunk_offsets), *chunk_offsets), 0)
+    stss = make_box('stss', struct.pack('>I', len(sync_samples))
+                    + struct.pack('>%dI' % len(sync_samples), *sync_samples), 0)
+    stbl = make_box('stbl', stts + stsc + stsz + stco + stss)
+    return make_box('trak', tkhd + make_box('mdia', mdhd + make_box('minf', stbl)))
+
+
+class SampleIndexTest(object):
+
+    def run(self):
+        # 7 samples: chunks of 3, 3 and 1 samples at offsets 1000, 5000 and 9000
+        sizes = [10, 20, 30, 40, 50, 60, 70]
+        trak = make_trak(sizes, [(6, 40), (1, 20)], [(1, 3), (3, 1)], [1000, 5000, 9000], [1, 4])
+        box = Box.getnextbox(DataBuffer(io.BytesIO(make_box('moov', trak))))
+        index = SampleIndex.from_boxes([box])[7]
+
+        assert len(index) == 7, "sample count %d" % len(index)
+        assert list(index.offsets) == [1000, 1010, 1030, 5000, 5040, 5090, 9000], "offsets %s" % index.offsets
+        assert list(index.decode_times) == [0, 40, 80, 120, 160, 200, 240], "times %s" % index.decode_times
+        assert index.duration == 260, "duration %d" % index.duration
+        assert index.sample(5) == (5040, 50, 160, False), "sample 5 %s" % (index.sample(5), )
+        assert index.sample(4)[3], "sample 4 is a sync sample"
+
+        assert index.sample_at(0) == 1 and index.sample_at(119) == 3 and index.sample_at(1000) == 7, "sample_at"
+        assert index.sample_at_seconds(0.16) == 5, "sample_at_seconds %s" % index.sample_at_seconds(0.16)
+        assert index.sync_sample_before(6) == 4 and index.sync_sample_before(3) == 1, "sync_sample_before"
+        assert index.sync_sample_after(2) == 4 and index.sync_sample_after(5) is None, "sync_sample_after"
+
+        # stts covering 5 of the 7 samples: the last two stay at the time where it ends
+        trak = make_trak(sizes, [(5, 40)], [(1, 3), (3, 1)], [1000, 5000, 9000], [1, 4])
+        box = Box.getnextbox(DataBuffer(io.BytesIO(make_box('moov', trak))))
+        index = SampleIndex.from_boxes([box])[7]
+        assert list(index.decode_times) == [0, 40, 80, 120, 160, 200, 200], "times %s" % index.decode_times
+        assert index.duration == 200, "duration %d" % index.duration
+        assert index.sample(7) == (9000, 70, 200, False), "sample 7 %s" % (index.sample(7), )
+        assert index.sample_at(1000) == 7, "sample_at %s" % index.sample_at(1000)
+
+        # Four chunks of 2 samples, then chunks of 3 with the last one only partly used
+        sizes = [1] * 12
+        trak = make_trak(sizes, [(12, 10)], [(1, 2), (5, 3)], [100, 200, 300, 400, 500, 600], [1])
+        box = Box.getnextbox(DataBuffer(io.BytesIO(make_box('moov', trak))))
+        index = SampleIndex.from_boxes([box])[7]
+        assert list(index.offsets) == [100, 101, 200, 201, 300, 301, 400, 401, 500, 501, 502, 600], \
+            "offsets %s" % index.offsets
+
+
+if __name__ == '__main__':
+    SampleIndexTest().run()
+    print("Success")
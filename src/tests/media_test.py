@@ -0,0 +1,59 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+import hashlib
+import os
+import tempfile
+
+from benchmarks.media import CASES, write_case
+from datasource import DataBuffer, FileSource
+from showboxes import getboxlist
+
+
+def generate(case, scale):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        write_case(case, path, scale)
+        with open(path, 'rb') as f:
+            data = f.read()
+            f.seek(0)
+            boxes = getboxlist(DataBuffer(FileSource(f)))
+    finally:
+        os.remove(path)
+    return data, boxes
+
+
+class MediaTest(object):
+
+    def run(self):
+        for case in CASES:
+            first, _ = generate(case, 0.0005)
+            second, _ = generate(case, 0.0005)
+            assert hashlib.sha1(first).digest() == hashlib.sha1(second).digest(), "%s is not deterministic" % case
+
+        _, boxes = generate('progressive', 0.001)
+        stbl = boxes[1].find_child('trak').find_child('mdia').find_child('minf').find_child('stbl')
+        assert len(stbl.find_child('stsz').entries) == 1000, "stsz entries"
+        assert len(stbl.find_child('stco').entries) == 1000, "stco entries"
+        mdat = boxes[-1]
+        assert stbl.find_child('stco').entries[0] == mdat.buffer_offset + 8, "first chunk is not at the mdat"
+
+        _, boxes = generate('fragmented', 0.001)
+        assert [box.boxtype for box in boxes].count('moof') == 50, "moof count"
+
+        _, boxes = generate('cenc', 0.002)
+        traf = boxes[2].find_child('traf')
+        saio = traf.find_child('saio')
+        senc = traf.children[-1]
+        assert senc.boxtype == 'senc', "senc is not last: %s" % senc
+        assert boxes[2].buffer_offset + saio.offsets[0] == senc.buffer_offset + 16, "saio does not point into senc"
+
+        _, boxes = generate('hds', 0.001)
+        afrt = boxes[0].fragment_run_table_entries[0]
+        assert afrt.fragment_entry_count == 1000 and afrt.fragment_entries[999][2] == 0, "afrt entries"
+
+
+if __name__ == '__main__':
+    MediaTest().run()
+    print("Success")
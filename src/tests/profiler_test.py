@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+
+from benchmarks.media import write_case
+from datasource import DataBuffer
+from isobmff.box import Box
+from isobmff.movie import MovieHeader
+from profiler import ParseProfiler, profile_file
+from showboxes import set_diagnostics_stream
+from structured import JsonRenderer
+
+
+class ProfilerTest(object):
+
+    def run(self):
+        originals = (Box.__dict__['parse_box'], MovieHeader.__dict__['generate_fields'],
+                     DataBuffer.__dict__['readmore'])
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            write_case('progressive', path, 0.0001)
+            args = argparse.Namespace(truncate=False, depth=None, debug=False, select=None)
+            out = io.BytesIO()
+            report = io.StringIO()
+            # Parser diagnostics would otherwise go to stderr, with the report
+            set_diagnostics_stream(io.StringIO())
+            with contextlib.redirect_stderr(report):
+                profile_file(path, args, JsonRenderer(out))
+        finally:
+            os.remove(path)
+        restored = (Box.__dict__['parse_box'], MovieHeader.__dict__['generate_fields'],
+                    DataBuffer.__dict__['readmore'])
+        assert restored == originals, "hooks left installed"
+        assert out.getvalue().startswith(b'{"name"'), "nothing rendered"
+        lines = report.getvalue().splitlines()
+        stages = [line.split()[0] for line in lines[3:6]]
+        assert stages == ['parse', 'format', 'render'], "stages %s" % stages
+        rows = dict((line.split()[0], line.split()) for line in lines[8:])
+        # stsz: 100 entries; generate_fields of mvhd goes through FullBox and Box but is one call
+        assert rows['stsz'][1:4:2] == ['1', str(12 + 8 + 4 * 100)], "stsz row %s" % rows['stsz']
+        assert rows['mvhd'][4] == '1', "mvhd fields calls %s" % rows['mvhd']
+
+        profiler = ParseProfiler()
+        profiler.install()
+        try:
+            buf = DataBuffer(io.BytesIO(b'\0\0\0\x10free' + b'\0' * 8))
+            Box.getnextbox(buf)
+        finally:
+            profiler.uninstall()
+        assert profiler.types['free'].parse_calls == 1 and profiler.types['free'].bytes == 16, "free stats"
+        assert Box.__dict__['parse_box'] is originals[0], "hooks left installed"
+
+
+if __name__ == '__main__':
+    ProfilerTest().run()
+    print("Success")
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+import io
+import json
+
+from structured import CborRenderer, JsonRenderer, NdjsonRenderer, cbor_encode
+from tree import Tree
+
+# Encodings from RFC 8949 appendix A
+CBOR_VECTORS = [
+    (0, '00'),
+    (23, '17'),
+    (24, '1818'),
+    (1000, '1903e8'),
+    (1000000, '1a000f4240'),
+    (1000000000000, '1b000000e8d4a51000'),
+    (-1, '20'),
+    (-1000, '3903e7'),
+    (1.1, 'fb3ff199999999999a'),
+    (False, 'f4'),
+    (None, 'f6'),
+    (b'\x01\x02\x03\x04', '4401020304'),
+    (u'ü', '62c3bc'),
+    ([1, [2, 3], [4, 5]], '8301820203820405'),
+    ({'a': 1}, 'a1616101'),
+]
+
+
+def make_tree():
+    root = Tree('file', 'File')
+    box = root.add_child(Tree('stsz', 'Sample size box'))
+    box.add_attr('sample sizes', [10, 20, 30])
+    box.add_child(Tree('free')).add_attr('size', 8, '8 bytes')
+    root.add_child(Tree('mdat'))
+    return root
+
+
+class StructuredOutputTest(object):
+
+    def run(self):
+        for value, expected in CBOR_VECTORS:
+            out = bytearray()
+            cbor_encode(value, out)
+            assert out.hex() == expected, "CBOR of %r: %s, expected %s" % (value, out.hex(), expected)
+
+        out = io.BytesIO()
+        JsonRenderer(out).render(make_tree())
+        assert json.loads(out.getvalue().decode('utf-8')) == make_tree().to_dict(), "json output"
+
+        out = io.BytesIO()
+        tree = make_tree()
+        NdjsonRenderer(out).render_stream(Tree('file', 'File'), iter(tree.children))
+        lines = out.getvalue().decode('utf-8').splitlines()
+        assert [json.loads(line) for line in lines] == [child.to_dict() for child in tree.children], "ndjson"
+
+        out = io.BytesIO()
+        CborRenderer(out).render(Tree('file', 'File'))
+        assert out.getvalue().hex() == 'bf' + '646e616d65' + '6466696c65' + '6464657363' + '6446696c65' + \
+            '686368696c6472656e' + '9f' + 'ffff', "empty CBOR tree %s" % out.getvalue().hex()
+
+
+if __name__ == '__main__':
+    StructuredOutputTest().run()
+    print("Success")
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+import argparse
+import io
+import queue
+import struct
+import threading
+
+from datasource import DataBuffer
+from isobmff.box import iter_boxes
+from tests.box_test import make_box
+from tree import Tree
+from treeloader import TreeLoader, expand_item, item_label
+
+ARGS = argparse.Namespace(truncate=True, depth=None)
+
+
+def mvhd_moov():
+    payload = struct.pack('>IIIIIH', 0, 0, 1000, 5000, 0x10000, 0x100) + b'\0' * 70 + struct.pack('>I', 2)
+    return make_box('moov', make_box('mvhd', payload, 0) + make_box('free', b'1'))
+
+
+class UiThread(object):
+    """Stands in for GLib.idle_add: posted calls are queued and run by the test, as by the main loop"""
+
+    def __init__(self):
+        self.calls = queue.Queue()
+
+    def post(self, function, *args):
+        self.calls.put((function, args))
+
+    def run_until(self, condition, timeout=5):
+        while not condition():
+            function, args = self.calls.get(timeout=timeout)
+            function(*args)
+
+
+class ModelTest(object):
+
+    def run(self):
+        node = Tree('file', 'File')
+        child = node.add_child(Tree('leaf', 'Leaf'))
+        assert item_label(node) == ('file', 'File', True), "tree label %s" % (item_label(node), )
+        assert item_label(child) == ('leaf', 'Leaf', False), "leaf label %s" % (item_label(child), )
+
+        buf = DataBuffer(io.BytesIO(mvhd_moov()))
+        moov = next(iter_boxes(buf, lazy=True))
+        assert item_label(moov) == ('moov', 'Movie container', True), "box label %s" % (item_label(moov), )
+        assert not moov.loaded, "labelling decoded the box"
+        fields, children = expand_item(moov, ARGS)
+        assert fields == [('size', len(mvhd_moov()))], "moov fields %s" % fields
+        assert [c.boxtype for c in children] == ['mvhd', 'free'], "moov children %s" % children
+        assert not children[0].loaded, "children should stay lazy until expanded"
+        fields, children = expand_item(children[0], ARGS)
+        assert ('timescale', 1000) in fields and children == [], "mvhd fields %s" % fields
+
+
+class PendingReadTest(object):
+
+    def run(self):
+        ui = UiThread()
+        loader = TreeLoader(ui.post, ARGS)
+        node = Tree('parsed', 'Parsed box')
+        node.add_attr('size', 8)
+        unblock = threading.Event()
+
+        def items():
+            yield node
+            # A read that does not return, e.g. stdin with nothing written yet
+            unblock.wait(10)
+
+        batches = []
+        expanded = []
+        loader.start(items(), lambda *batch: batches.append(batch))
+        ui.run_until(lambda: batches)
+        assert batches[0][0] == [node], "first batch %s" % (batches[0], )
+        # Expanding while the loader waits in a read is answered all the same
+        loader.expand(node, lambda *result: expanded.append(result), 'token')
+        ui.run_until(lambda: expanded, timeout=2)
+        assert expanded == [('token', [('size', 8)], [], None)], "expanded %s" % expanded
+        unblock.set()
+        ui.run_until(lambda: batches[-1][2])
+        loader.cancel()
+        loader.join(1.0)
+
+
+class GtkSmokeTest(object):
+    """Runs the window for real where PyGObject and a display are available; skipped otherwise"""
+
+    def run(self):
+        try:
+            import gi
+            gi.require_version("Gtk", "3.0")
+            from gi.repository import GLib
+            from gi.repository import Gtk
+        except (ImportError, ValueError):
+            print("GtkSmokeTest skipped: PyGObject is not installed")
+            return
+        if not Gtk.init_check(None)[0]:
+            print("GtkSmokeTest skipped: no display")
+            return
+        from gui import GtkRenderer
+        renderer = GtkRenderer(ARGS)
+        buf = DataBuffer(io.BytesIO(mvhd_moov()))
+        seen = []
+
+        def check():
+            store = renderer.treestore
+            row = store.get_iter_first()
+            if row is None or not renderer.loader.done:
+                return True
+            if not seen:
+                seen.append(store.get_value(row, 1).boxtype)
+                renderer.treeview.expand_row(store.get_path(row), False)
+                return True
+            child = store.iter_children(row)
+            if store.get_value(child, 1) is GtkRenderer.LOADING:
+                return True
+            seen.append(store.iter_n_children(row))
+            renderer.window.destroy()
+            return False
+
+        GLib.timeout_add(20, check)
+        GLib.timeout_add(10000, Gtk.main_quit)
+        renderer.render_boxes('test', iter_boxes(buf, lazy=True))
+        # One field row (size) and the mvhd and free rows
+        assert seen == ['moov', 3], "window showed %s" % seen
+
+
+if __name__ == '__main__':
+    ModelTest().run()
+    PendingReadTest().run()
+    GtkSmokeTest().run()
+    print("Success")
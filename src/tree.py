@@ -33,5 +33,15 @@ class Tree(object):
         self.children.append(child)
         return child
 
+    def to_dict(self):
+        """Plain dict/list form of the tree, e.g. for json; attrs become [name, value(, display value)]"""
+        d = {'name': self.name, 'desc': self.desc}
+        if len(self.attrs):
+            d['fields'] = [[a.name, a.value] if a.display_value is None else [a.name, a.value, a.display_value]
+                           for a in self.attrs]
+        if len(self.children):
+            d['children'] = [child.to_dict() for child in self.children]
+        return d
+
     def __str__(self):
         return self.name
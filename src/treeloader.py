@@ -0,0 +1,141 @@
+import queue
+import threading
+
+from tree import Tree
+
+
+def item_label(item):
+    """(name, description, expandable) of a Tree node or a Box, as shown on its collapsed row"""
+    if isinstance(item, Tree):
+        return item.name, item.desc, bool(len(item.attrs) or len(item.children))
+    from isobmff.box import Box
+    return item.boxtype, Box.getboxdesc(item.boxtype), True
+
+
+def expand_item(item, args):
+    """
+    Rows under an expanded item: ([(name, value)] of its fields, [child items]). Boxes yielded as
+    fields come back as Tree nodes; child boxes are returned as they are, a lazy one still unparsed.
+    """
+    if isinstance(item, Tree):
+        node = item
+        boxes = []
+    else:
+        from showboxes import get_box_node
+        node = get_box_node(item, args)
+        boxes = list(item.children)
+    fields = [(attr.name, attr.display_value if attr.display_value else attr.value) for attr in node.attrs]
+    return fields, list(node.children) + boxes
+
+
+class TreeLoader(object):
+    """
+    Feeds a tree view from two background threads, so that the UI thread neither parses nor
+    waits. The loader thread pulls top level items (parsing them) and the expander thread
+    decodes the items whose rows are expanded. Results are handed over with post(function, *args),
+    which runs function on the UI thread (GLib.idle_add for Gtk). Parsed items are collected
+    until the UI thread takes them, so they arrive in batches when it is busy and one by one
+    when it is not. Lazily parsed boxes read through the buffer the loader is parsing, so
+    decoding one waits for the loader to finish the box it is on; only the two background
+    threads share that lock.
+    """
+
+    def __init__(self, post, args=None):
+        self.post = post
+        self.args = args
+        self.buffer_lock = threading.Lock()
+        # stopped ends loading, cancelled expanding as well
+        self.stopped = threading.Event()
+        self.cancelled = threading.Event()
+        self.requests = queue.Queue()
+        self.threads = []
+        # Items parsed but not yet taken by the UI thread, and the state that goes with them
+        self.pending_lock = threading.Lock()
+        self.pending = []
+        self.fraction = None
+        self.done = False
+        self.error = None
+        self.drain_posted = False
+
+    def start(self, items, on_batch, progress=None):
+        """
+        Pull items in the background; on_batch(items, fraction, done, error) is posted for each
+        batch. progress, if given, returns the fraction of the input done so far.
+        """
+        for target, args in ((self.load, (iter(items), on_batch, progress)), (self.expand_requests, ())):
+            thread = threading.Thread(target=target, args=args)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def expand(self, item, on_expanded, token=None):
+        """Decode item in the background, then post on_expanded(token, fields, children, error)"""
+        self.requests.put((item, on_expanded, token))
+
+    def stop(self):
+        self.stopped.set()
+
+    def cancel(self):
+        self.stopped.set()
+        self.cancelled.set()
+        self.requests.put(None)
+
+    def join(self, timeout=None):
+        # A thread blocked in a read is a daemon; do not wait long for it
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def hand_over(self, on_batch, item=None, fraction=None, done=False, error=None):
+        with self.pending_lock:
+            if item is not None:
+                self.pending.append(item)
+            self.fraction = fraction
+            self.done = done
+            self.error = error
+            posted = self.drain_posted
+            self.drain_posted = True
+        if not posted:
+            self.post(self.drain, on_batch)
+
+    def drain(self, on_batch):
+        """UI thread: take the items parsed so far"""
+        with self.pending_lock:
+            items = self.pending
+            self.pending = []
+            self.drain_posted = False
+            state = (self.fraction, self.done, self.error)
+        on_batch(items, *state)
+        # Run once; idle_add would otherwise call again
+        return False
+
+    def load(self, items, on_batch, progress):
+        error = None
+        try:
+            while not self.stopped.is_set():
+                with self.buffer_lock:
+                    item = next(items, None)
+                    fraction = progress() if progress is not None else None
+                if item is None:
+                    break
+                self.hand_over(on_batch, item, fraction)
+        except Exception as e:
+            error = str(e)
+        self.hand_over(on_batch, None, 1.0, True, error)
+
+    def expand_requests(self):
+        while not self.cancelled.is_set():
+            request = self.requests.get()
+            if request is None:
+                break
+            item, on_expanded, token = request
+            try:
+                if getattr(item, 'lazy', False):
+                    with self.buffer_lock:
+                        fields, children = expand_item(item, self.args)
+                else:
+                    # Fully parsed boxes and tree nodes do not read; a pending read does not hold them up
+                    fields, children = expand_item(item, self.args)
+            except Exception as e:
+                self.post(on_expanded, token, None, None, str(e))
+                continue
+            self.post(on_expanded, token, fields, children, None)